@@ -5,11 +5,10 @@ import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-import pyodbc
 import settings
-from elasticsearch import Elasticsearch
-import certifi
 from es_docs import process_data
+from es_client import get_es_client
+from ildb_pool import ildb_pool
 import logging
 from waitress import serve
 
@@ -61,42 +60,12 @@ def ingest():
         ],
     }
     if settings.ildb_host and settings.ildb_user and settings.ildb_password and settings.ildb_port:
-        ildb_connection = pyodbc.connect(
-            server=settings.ildb_host,
-            database="ILDB",
-            user=settings.ildb_user,
-            tds_version="7.4",
-            password=settings.ildb_password,
-            port=settings.ildb_port,
-            driver="FreeTDS",
-        )
+        ildb_connection = ildb_pool.acquire()
     else:
         ildb_connection = None
     if es_index and es_port and es_host:
-        if settings.flask_local:
-            es = Elasticsearch(
-                hosts=[
-                    {
-                        "host": es_host,
-                        "use_ssl": True,
-                        "verify_certs": False,
-                        "port": es_port,
-                        "ca_certs": certifi.where(),
-                    }
-                ]
-            )
-        else:
-            es = Elasticsearch(
-                hosts=[
-                    {
-                        "host": es_host,
-                        "use_ssl": True,
-                        "verify_certs": True,
-                        "port": es_port,
-                        "ca_certs": certifi.where(),
-                    }
-                ]
-            )
+        # Certificates aren't checked when running locally, through the tunnel
+        es = get_es_client(host=es_host, port=es_port, verify_certs=not settings.flask_local)
     else:
         es = None
     settings_dict["ildb_connection"] = bool(ildb_connection)
@@ -105,7 +74,8 @@ def ingest():
         print("Got a connection")
         return Response(
             stream_with_context(
-                process_data(
+                pooled_process_data(
+                    ildb_connection,
                     elastic=es,
                     elastic_index=es_index,
                     start=start,
@@ -113,14 +83,29 @@ def ingest():
                     lettercode=lettercode,
                     verbosity=False,
                     ingest=action,
-                    database_connection=ildb_connection,
                 )
             )
         )
     else:
+        if ildb_connection:
+            ildb_pool.release(ildb_connection)
         return jsonify(settings_dict)
 
 
+def pooled_process_data(ildb_connection, **kwargs):
+    """
+    Run process_data, giving the ILDB connection back to the pool once the response is finished or abandoned
+
+    :param ildb_connection: connection from ildb_pool
+    :param kwargs: passed to process_data
+    :return:
+    """
+    try:
+        yield from process_data(database_connection=ildb_connection, **kwargs)
+    finally:
+        ildb_pool.release(ildb_connection)
+
+
 if __name__ == "__main__":
     # app.run(debug=True)
     serve(app, port=8000)
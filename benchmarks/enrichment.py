@@ -0,0 +1,146 @@
+"""
+Compare the peak memory and CPU time of decorating a chunk with Mongo data by deep copying it first
+(how get_mongo used to work) with decorating it in place (enrich_records).
+
+NLP is switched off so that only the cost of the copy is measured.
+
+Run from the root of the repo:
+
+    python benchmarks/enrichment.py --chunk 1000 --repeats 5
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from copy import deepcopy
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from mongo_grabber import enrich_records
+
+
+def make_chunk(size):
+    """
+    Make a list of objects that look like the output of make_canonical for a chunk of items
+
+    :param size: number of objects
+    :return:
+    """
+    chunk = []
+    for i in range(1, size + 1):
+        piece = f"{i // 50 + 1}"
+        path = OrderedDict(
+            [
+                ("Department", "FO"),
+                ("Division", 1),
+                ("Series", "371"),
+                ("Subseries", 492),
+                ("Subsubseries", None),
+                ("Piece", piece),
+                ("Item", str(i)),
+            ]
+        )
+        doc_id = f"FO:~1:371:~492:{piece}:{i}"
+        chunk.append(
+            {
+                "letter_code": "FO",
+                "division_no": 1,
+                "class_no": 371,
+                "class_hdr_no": 492,
+                "piece_ref": piece,
+                "item_ref": str(i),
+                "title": "German Iron and Steel industry: minutes of meetings of the Combined "
+                "Steel Group; production and allocation.",
+                "series": "371",
+                "path": path,
+                "level": "Item",
+                "catalogue_ref": f"FO 371/{piece}/{i}",
+                "id": doc_id,
+                "matches": [
+                    f"FO 371/{piece}/{i}",
+                    f"FO/371/{piece}/{i}",
+                    f"FO:371:{piece}:{i}",
+                    f"FO/~1/371/~492/{piece}/{i}",
+                    doc_id,
+                ],
+                "first_date": "1950-01-01",
+                "first_date_obj": {"year": 1950, "month": 1, "day": 1, "century": 19},
+                "last_date": "1950-12-31",
+                "last_date_obj": {"year": 1950, "month": 12, "day": 31, "century": 19},
+                "eras": ["postwar"],
+                "research_guides": {"Object": [], "Department": [12, 40], "Series": [], "All": []},
+            }
+        )
+    return chunk
+
+
+def make_mongo(chunk):
+    """
+    Make a dict of mapped Mongo data, by id, for a chunk
+
+    :param chunk:
+    :return:
+    """
+    return {
+        obj["id"]: {
+            "iaid": f"C{100000 + n}",
+            "title": obj["title"],
+            "scope_and_content": {
+                "description": f"<scopecontent><p>{obj['title']}</p></scopecontent>"
+            },
+            "covering_dates": "1950",
+            "legal_status": "Public Record(s)",
+            "held_by": [{"corporate_body_name": "The National Archives, Kew"}],
+        }
+        for n, obj in enumerate(chunk)
+    }
+
+
+def measure(func, chunk_size, repeats):
+    """
+    Run func against fresh chunks, returning the best CPU time and the largest peak of traced memory
+
+    :param func: function taking (chunk, mongo_data)
+    :param chunk_size:
+    :param repeats:
+    :return: (seconds, bytes)
+    """
+    best_time = None
+    peak = 0
+    for _ in range(repeats):
+        chunk = make_chunk(chunk_size)
+        mongo_data = make_mongo(chunk)
+        tracemalloc.start()
+        start = time.process_time()
+        func(chunk, mongo_data)
+        elapsed = time.process_time() - start
+        _, run_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+        peak = max(peak, run_peak)
+    return best_time, peak
+
+
+def copy_then_enrich(chunk, mongo_data):
+    return enrich_records(deepcopy(chunk), mongo_data)
+
+
+def enrich_in_place(chunk, mongo_data):
+    return enrich_records(chunk, mongo_data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunk", type=int, default=1000, help="records per chunk")
+    parser.add_argument("--repeats", type=int, default=5, help="runs per variant")
+    args = parser.parse_args()
+    results = {
+        "deepcopy + enrich": measure(copy_then_enrich, args.chunk, args.repeats),
+        "enrich in place": measure(enrich_in_place, args.chunk, args.repeats),
+    }
+    print(f"Chunk of {args.chunk} records, best of {args.repeats} runs")
+    print(f"{'variant':<20}{'cpu (ms)':>12}{'peak (KiB)':>14}")
+    for name, (cpu, peak) in results.items():
+        print(f"{name:<20}{cpu * 1000:>12.1f}{peak / 1024:>14.1f}")
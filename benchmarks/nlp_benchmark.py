@@ -0,0 +1,263 @@
+"""
+Measure the throughput, latency and accuracy of the entity extraction for each NLP configuration, against the
+golden corpus in benchmarks/golden.
+
+The corpus is a JSON line per record with the flattened text (as flatten_to_string makes it, markup and all),
+the level, lettercode and whether it is a medal card. The baseline (nlp_baseline_v1.json) holds the entities
+found for each record by the extraction as it was before the NLP changes (legacy_nlp.py), with the spacy and
+model versions pinned in requirements.txt; precision and recall are of the (label, text, date) of each entity
+against it. Without a baseline, only the throughput and latency are reported.
+
+    full       analyse_text with no cache, tiers or archival places
+    cached     with an empty entity cache, so repeated text in the corpus and every repeat after the first hit it
+    tiered     with the level and lettercode, so the rules in config/nlp_tiers.json apply
+    gazetteer  with the archival places added to the place index
+    batching   the texts go through nlp.pipe in batches, then spans_to_entities
+
+Everything runs offline against the installed model. Run from the root of the repo:
+
+    python benchmarks/nlp_benchmark.py --record          # (re)write the baseline, with the pinned model
+    python benchmarks/nlp_benchmark.py --repeats 5       # compare every configuration with the baseline
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import dateparser.conf
+import spacy
+import gazetteer
+import legacy_nlp
+import nlp
+import nlp_tiers
+from result_cache import ResultCache
+
+golden_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "golden")
+corpus_file = os.path.join(golden_dir, "nlp_corpus_v1.jsonl")
+baseline_file = os.path.join(golden_dir, "nlp_baseline_v1.json")
+CONFIGURATIONS = ("full", "cached", "tiered", "gazetteer", "batching")
+# The spacy and model versions in requirements.txt, which the baseline has to be recorded with
+PINNED_MODEL = {"lang": "en", "name": "core_web_sm", "version": "2.2.5", "spacy": "2.2.4"}
+# dateparser fills in a missing day or month from today's date, so fix today for the dates to be repeatable
+dateparser.conf.settings.RELATIVE_BASE = datetime.datetime(2020, 1, 1)
+
+
+def load_corpus(path=corpus_file):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def entity_keys(entities):
+    """
+    Reduce the entity output, legacy or compact, to what is compared with the baseline
+
+    :param entities: output of analyse_text or spans_to_entities, or None
+    :return: sorted list of [label, text, date], with the date as YYYY-MM-DD or ""
+    """
+    if not entities:
+        return []
+    keys = set()
+    for entity in entities.get("entity_list", entities.get("entities", [])):
+        date = entity.get("date")
+        date = str(date)[:10] if date else ""
+        keys.add((entity["label"], entity["text"], date))
+    return [list(k) for k in sorted(keys)]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def configure(name):
+    """
+    Set up the module state for a configuration, putting back the defaults for the others
+
+    :param name: one of CONFIGURATIONS
+    :return:
+    """
+    nlp.entity_cache = ResultCache(maxsize=100000 if name == "cached" else 0)
+    nlp_tiers.rules = nlp_tiers.load_rules() if name == "tiered" else None
+    extra_places = gazetteer.load_archival_places() if name == "gazetteer" else None
+    gazetteer.place_index = gazetteer.build_place_index(extra_places)
+
+
+def run_records(name, corpus, spacy_nlp, batch_size):
+    """
+    Extract the entities for every record in the corpus once
+
+    :param name: configuration
+    :param corpus: list of records
+    :param spacy_nlp: spacy model
+    :param batch_size: texts per nlp.pipe call, for batching
+    :return: (results by record id, seconds for each record)
+    """
+    results = {}
+    latencies = []
+    if name == "batching":
+        for offset in range(0, len(corpus), batch_size):
+            batch = corpus[offset : offset + batch_size]
+            started = time.perf_counter()
+            texts = [nlp.SPACES.sub(" ", nlp.strip_html(r["text"])).strip() for r in batch]
+            docs = spacy_nlp.pipe(texts, batch_size=batch_size)
+            for record, text, doc in zip(batch, texts, docs):
+                spans = [(e.text, e.label_, e.start_char, e.end_char) for e in doc.ents]
+                results[record["id"]] = nlp.spans_to_entities(
+                    spans, text, medal_card=record["medal_card"]
+                )
+            # The batch is timed as a whole, so each record gets its share
+            latencies.extend([(time.perf_counter() - started) / len(batch)] * len(batch))
+        return results, latencies
+    tiered = name == "tiered"
+    for record in corpus:
+        started = time.perf_counter()
+        analysis = nlp.analyse_text(
+            record["text"],
+            spacy_nlp,
+            medal_card=record["medal_card"],
+            level=record["level"] if tiered else None,
+            lettercode=record["letter_code"] if tiered else None,
+        )
+        latencies.append(time.perf_counter() - started)
+        results[record["id"]] = analysis[2] if analysis else None
+    return results, latencies
+
+
+def score(results, baseline):
+    """
+    Micro-averaged precision and recall of the entities against the baseline
+
+    :param results: entity output by record id
+    :param baseline: list of [label, text, date] by record id
+    :return: (precision, recall, ids of the records that differ)
+    """
+    found = expected = matched = 0
+    changed = []
+    for record_id, keys in baseline.items():
+        got = {tuple(k) for k in entity_keys(results.get(record_id))}
+        want = {tuple(k) for k in keys}
+        found += len(got)
+        expected += len(want)
+        matched += len(got & want)
+        if got != want:
+            changed.append(record_id)
+    precision = matched / found if found else 1.0
+    recall = matched / expected if expected else 1.0
+    return precision, recall, changed
+
+
+def benchmark(name, corpus, spacy_nlp, repeats, batch_size):
+    """
+    :return: dict of the measurements for a configuration, and its results from the first pass
+    """
+    configure(name)
+    latencies = []
+    first_results = None
+    started = time.perf_counter()
+    for _ in range(repeats):
+        results, run_latencies = run_records(name, corpus, spacy_nlp, batch_size)
+        latencies.extend(run_latencies)
+        first_results = first_results or results
+    elapsed = time.perf_counter() - started
+    return {
+        "records_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "cache": nlp.entity_cache.report() if name == "cached" else "",
+    }, first_results
+
+
+def model_meta(spacy_nlp):
+    return dict(
+        {k: spacy_nlp.meta.get(k) for k in ("lang", "name", "version")}, spacy=spacy.__version__
+    )
+
+
+def record_baseline(corpus, spacy_nlp, path=baseline_file):
+    """
+    Write the entities that the pre-series extraction finds for each record
+
+    :param corpus: list of records
+    :param spacy_nlp: spacy model, which has to be the pinned one
+    :param path:
+    :return:
+    """
+    model = model_meta(spacy_nlp)
+    if model != PINNED_MODEL:
+        sys.exit(f"The baseline has to be recorded with {PINNED_MODEL}, not {model}")
+    results = {
+        record["id"]: legacy_nlp.string_to_entities(
+            record["text"], spacy_nlp, medal_card=record["medal_card"]
+        )
+        for record in corpus
+    }
+    baseline = {
+        "model": model,
+        "corpus": os.path.basename(corpus_file),
+        "records": {record_id: entity_keys(entities) for record_id, entities in results.items()},
+    }
+    with open(path, "w") as f:
+        f.write(json.dumps(baseline, indent=2, ensure_ascii=False) + "\n")
+    print(f"Wrote the entities for {len(results)} records to {path}")
+
+
+def load_baseline(path=baseline_file):
+    """
+    :param path:
+    :return: the baseline, or None if there isn't one
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model", default="en_core_web_sm", help="spacy model to load")
+    parser.add_argument("--record", action="store_true", help="write the baseline and stop")
+    parser.add_argument("--repeats", type=int, default=3, help="passes over the corpus")
+    parser.add_argument("--batch-size", type=int, default=16, help="texts per nlp.pipe call")
+    parser.add_argument(
+        "--only", nargs="+", choices=CONFIGURATIONS, default=CONFIGURATIONS, help="configurations"
+    )
+    args = parser.parse_args()
+    corpus = load_corpus()
+    spacy_nlp = spacy.load(args.model)
+    if args.record:
+        record_baseline(corpus, spacy_nlp)
+        sys.exit()
+    baseline = load_baseline()
+    model = model_meta(spacy_nlp)
+    if baseline is None:
+        print(
+            f"No baseline at {baseline_file}, so no precision or recall; record one with --record"
+        )
+    elif model != baseline["model"]:
+        print(f"Warning: the baseline was recorded with {baseline['model']}, not {model}")
+    print(f"{len(corpus)} records, {args.repeats} passes, model {model['name']} {model['version']}")
+    print(
+        f"{'configuration':<14}{'records/s':>12}{'p50 (ms)':>10}{'p99 (ms)':>10}"
+        f"{'precision':>11}{'recall':>8}{'changed':>9}"
+    )
+    for name in args.only:
+        measurements, results = benchmark(name, corpus, spacy_nlp, args.repeats, args.batch_size)
+        accuracy = f"{'-':>11}{'-':>8}{'-':>9}"
+        changed = []
+        if baseline is not None:
+            precision, recall, changed = score(results, baseline["records"])
+            accuracy = f"{precision:>11.3f}{recall:>8.3f}{len(changed):>9}"
+        print(
+            f"{name:<14}{measurements['records_per_second']:>12.1f}{measurements['p50_ms']:>10.2f}"
+            f"{measurements['p99_ms']:>10.2f}{accuracy}"
+        )
+        if measurements["cache"]:
+            print(f"{'':<14}cache: {measurements['cache']}")
+        if changed:
+            print(f"{'':<14}differs on: {', '.join(changed)}")
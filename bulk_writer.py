@@ -0,0 +1,428 @@
+"""
+Bulk ingest into Elasticsearch, with the actions serialised by orjson rather than the client's JSON encoder.
+
+parallel_bulk serialises every action and document with json.dumps on the main thread, which is a large share
+of the CPU time at bulk time for documents holding the Mongo data, entities, dates and guides. bulk_actions
+does the same job: the actions are expanded with the client's expand_action, encoded by orjson straight to
+bytes, joined into an NDJSON body per chunk and sent with client.bulk from a pool of threads.
+
+The output is the same as parallel_bulk's: (ok, info) for every action, a BulkIndexError for the documents
+that failed to index when raise_on_error is set, and the TransportError when raise_on_exception is set.
+
+bulk_actions drains its actions before it returns, so a caller that bulks each chunk of records in turn leaves
+Elasticsearch idle while the next chunk is prepared. BulkWriter is long lived instead: documents are added as
+they are made, across chunks and levels, and it keeps up to in_flight bulk requests going in the background.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import BulkIndexError, expand_action
+from elasticsearch.serializer import JSONSerializer
+from settings import bulk_in_flight, bulk_chunk_size, bulk_flush_seconds, bulk_queue_size
+
+logger = logging.getLogger("")
+
+NEWLINE = b"\n"
+# Integer keys etc. are turned into strings, as json.dumps does
+OPTIONS = orjson.OPT_NON_STR_KEYS
+# orjson handles datetimes, dates and UUIDs itself, and passes anything else (Decimal, numpy and pandas types)
+# to the client's serializer
+default = JSONSerializer().default
+
+
+def dumps(data):
+    """
+    :param data: action, document, or a string of JSON
+    :return: bytes
+    """
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    return orjson.dumps(data, default=default, option=OPTIONS)
+
+
+def encode_action(action):
+    """
+    Expand and serialise an action
+
+    :param action: e.g. from es_docs.ingest_list
+    :return: (bulk_item, lines), where bulk_item is (action, data) for the error reporting, and lines are the
+    NDJSON lines for the body, with their newlines
+    """
+    action, data = expand_action(action)
+    if data is None:
+        return (action,), [dumps(action), NEWLINE]
+    return (action, data), [dumps(action), NEWLINE, dumps(data), NEWLINE]
+
+
+def chunk_actions(actions, chunk_size=500, max_chunk_bytes=100 * 1024 * 1024):
+    """
+    Expand and serialise the actions, splitting them into chunks by count and size
+
+    :param actions: iterable of actions, e.g. from es_docs.ingest_list
+    :param chunk_size: most actions in a chunk
+    :param max_chunk_bytes: most bytes in the body of a chunk
+    :return: generator of (bulk_data, body), where bulk_data is a list of (action, data) for the error reporting
+    """
+    bulk_data = []
+    lines = []
+    size = 0
+    for action in actions:
+        bulk_item, encoded = encode_action(action)
+        action_size = sum(len(line) for line in encoded)
+        if bulk_data and (len(bulk_data) == chunk_size or size + action_size > max_chunk_bytes):
+            yield bulk_data, b"".join(lines)
+            bulk_data = []
+            lines = []
+            size = 0
+        bulk_data.append(bulk_item)
+        lines.extend(encoded)
+        size += action_size
+    if bulk_data:
+        yield bulk_data, b"".join(lines)
+
+
+def process_response(resp, bulk_data, raise_on_error=True):
+    """
+    :param resp: response to a bulk request
+    :param bulk_data: the (action, data) in the request
+    :param raise_on_error: raise a BulkIndexError if any documents failed
+    :return: list of (ok, info)
+    """
+    results = []
+    errors = []
+    for data, item in zip(bulk_data, resp["items"]):
+        op_type, item = item.popitem()
+        ok = 200 <= item.get("status", 500) < 300
+        if not ok and raise_on_error:
+            # include the document, as parallel_bulk does
+            if len(data) > 1:
+                item["data"] = data[1]
+            errors.append({op_type: item})
+        if ok or not errors:
+            results.append((ok, {op_type: item}))
+    if errors:
+        raise BulkIndexError(f"{len(errors)} document(s) failed to index.", errors)
+    return results
+
+
+def process_error(error, bulk_data, raise_on_exception=True, raise_on_error=True):
+    """
+    Mark every action in a chunk as failed, when the request itself failed
+
+    :param error: TransportError
+    :param bulk_data:
+    :param raise_on_exception: re-raise the error
+    :param raise_on_error: raise a BulkIndexError
+    :return: list of (ok, info)
+    """
+    if raise_on_exception:
+        raise error
+    failed = []
+    for data in bulk_data:
+        op_type, action = data[0].copy().popitem()
+        info = {"error": str(error), "status": error.status_code, "exception": error}
+        if op_type != "delete":
+            info["data"] = data[1]
+        info.update(action)
+        failed.append({op_type: info})
+    if raise_on_error:
+        raise BulkIndexError(f"{len(failed)} document(s) failed to index.", failed)
+    return [(False, info) for info in failed]
+
+
+def send_chunk(client, bulk_data, body, raise_on_exception=True, raise_on_error=True, **kwargs):
+    """
+    Send one bulk request
+
+    :param client: Elasticsearch client
+    :param bulk_data:
+    :param body: NDJSON bytes
+    :param raise_on_exception:
+    :param raise_on_error:
+    :param kwargs: passed to client.bulk, e.g. index, request_timeout
+    :return: list of (ok, info)
+    """
+    try:
+        resp = client.bulk(body=body, **kwargs)
+    except TransportError as e:
+        return process_error(e, bulk_data, raise_on_exception, raise_on_error)
+    return process_response(resp, bulk_data, raise_on_error)
+
+
+def bulk_actions(
+    client,
+    actions,
+    thread_count=4,
+    chunk_size=500,
+    max_chunk_bytes=100 * 1024 * 1024,
+    queue_size=4,
+    raise_on_exception=True,
+    raise_on_error=True,
+    **kwargs,
+):
+    """
+    Drop-in replacement for elasticsearch.helpers.parallel_bulk
+
+    :param client: Elasticsearch client
+    :param actions: iterable of actions
+    :param thread_count: bulk requests in flight at once
+    :param chunk_size: most actions per request
+    :param max_chunk_bytes: most bytes per request
+    :param queue_size: chunks serialised ahead of the requests in flight
+    :param raise_on_exception:
+    :param raise_on_error:
+    :param kwargs: passed to client.bulk, e.g. index, request_timeout
+    :return: generator of (ok, info), in the order of the actions
+    """
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        for bulk_data, body in chunk_actions(actions, chunk_size, max_chunk_bytes):
+            pending.append(
+                executor.submit(
+                    send_chunk,
+                    client,
+                    bulk_data,
+                    body,
+                    raise_on_exception,
+                    raise_on_error,
+                    **kwargs,
+                )
+            )
+            if len(pending) >= thread_count + queue_size:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+class BulkWriter:
+    """
+    Send actions to Elasticsearch in the background, with several bulk requests in flight.
+
+    A batching thread serialises the actions into chunks, which are sent once they reach chunk_size actions
+    or max_chunk_bytes, or once flush_seconds have passed since the first action in the chunk. in_flight
+    threads send the chunks. Once they are all busy, the chunks back up, then the queue of actions, and add
+    blocks until there is room, so the producer is held back rather than the documents piling up in memory.
+
+    Failed documents are logged, as p_bulk does. An exception from a bulk request (BulkIndexError or
+    TransportError, with raise_on_error and raise_on_exception) is raised by the next add, flush or close.
+
+        with BulkWriter(es, index=es_index, request_timeout=1000) as writer:
+            for chunk in chunks:
+                writer.add_many(ingest_list(chunk, index=es_index))
+    """
+
+    STOP = object()
+
+    def __init__(
+        self,
+        client,
+        in_flight=bulk_in_flight,
+        chunk_size=bulk_chunk_size,
+        max_chunk_bytes=100 * 1024 * 1024,
+        flush_seconds=bulk_flush_seconds,
+        queue_size=bulk_queue_size,
+        raise_on_exception=True,
+        raise_on_error=True,
+        verbose=False,
+        **kwargs,
+    ):
+        """
+        :param client: Elasticsearch client
+        :param in_flight: bulk requests sent at once
+        :param chunk_size: most actions per request
+        :param max_chunk_bytes: most bytes per request
+        :param flush_seconds: longest an action waits for its chunk to fill
+        :param queue_size: most actions waiting to be serialised, before add blocks
+        :param raise_on_exception:
+        :param raise_on_error:
+        :param verbose: log every document, not just failures
+        :param kwargs: passed to client.bulk, e.g. index, request_timeout
+        """
+        self.client = client
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.flush_seconds = flush_seconds
+        self.raise_on_exception = raise_on_exception
+        self.raise_on_error = raise_on_error
+        self.verbose = verbose
+        self.kwargs = kwargs
+        self.actions = queue.Queue(maxsize=queue_size)
+        self.chunks = queue.Queue(maxsize=in_flight)
+        # Chunks made but not yet sent, for flush
+        self.pending = 0
+        self.pending_changed = threading.Condition()
+        self.error = None
+        self.stats = Counter()
+        self.closed = False
+        # Daemon threads, so that an abandoned writer doesn't keep the process alive
+        self.threads = [threading.Thread(target=self.batch, daemon=True)]
+        self.threads += [threading.Thread(target=self.send, daemon=True) for _ in range(in_flight)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, action):
+        """
+        Queue an action, blocking while the writer is saturated
+
+        :param action: e.g. from es_docs.ingest_list
+        :return:
+        """
+        self.raise_error()
+        if self.closed:
+            raise RuntimeError("BulkWriter is closed")
+        self.actions.put(action)
+
+    def add_many(self, actions):
+        for action in actions:
+            self.add(action)
+
+    def flush(self):
+        """
+        Send everything added so far, and wait for the responses
+
+        :return:
+        """
+        if not self.closed:
+            done = threading.Event()
+            self.actions.put(done)
+            done.wait()
+        self.raise_error()
+
+    def close(self):
+        """
+        Send everything added so far, and stop the threads
+
+        :return:
+        """
+        if not self.closed:
+            self.closed = True
+            self.actions.put(self.STOP)
+            for thread in self.threads:
+                thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def report(self):
+        """
+        :return: string with the documents and requests sent so far
+        """
+        with self.pending_changed:
+            return (
+                f"{self.stats['ok']} documents indexed, {self.stats['failed']} failed, "
+                f"in {self.stats['requests']} requests"
+            )
+
+    def queue_chunk(self, bulk_data, lines):
+        with self.pending_changed:
+            self.pending += 1
+        self.chunks.put((bulk_data, b"".join(lines)))
+
+    def wait_for_pending(self):
+        with self.pending_changed:
+            self.pending_changed.wait_for(lambda: self.pending == 0)
+
+    def batch(self):
+        """
+        Serialise the actions into chunks, and hand them to the sending threads
+        """
+        bulk_data = []
+        lines = []
+        size = 0
+        deadline = None
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if bulk_data else None
+            try:
+                item = self.actions.get(timeout=timeout)
+            except queue.Empty:
+                # The chunk has waited flush_seconds
+                item = None
+            if item is None or item is self.STOP or isinstance(item, threading.Event):
+                if bulk_data:
+                    self.queue_chunk(bulk_data, lines)
+                    bulk_data, lines, size = [], [], 0
+                if item is self.STOP:
+                    for _ in self.threads[1:]:
+                        self.chunks.put(self.STOP)
+                    return
+                if item is not None:
+                    self.wait_for_pending()
+                    item.set()
+                continue
+            try:
+                bulk_item, encoded = encode_action(item)
+            except Exception as e:
+                logger.exception(f"Couldn't serialise {item}")
+                self.error = self.error or e
+                continue
+            action_size = sum(len(line) for line in encoded)
+            if bulk_data and size + action_size > self.max_chunk_bytes:
+                self.queue_chunk(bulk_data, lines)
+                bulk_data, lines, size = [], [], 0
+            if not bulk_data:
+                deadline = time.monotonic() + self.flush_seconds
+            bulk_data.append(bulk_item)
+            lines.extend(encoded)
+            size += action_size
+            if len(bulk_data) >= self.chunk_size:
+                self.queue_chunk(bulk_data, lines)
+                bulk_data, lines, size = [], [], 0
+
+    def send(self):
+        """
+        Send chunks until told to stop
+        """
+        while True:
+            item = self.chunks.get()
+            if item is self.STOP:
+                return
+            bulk_data, body = item
+            ok = failed = 0
+            try:
+                results = send_chunk(
+                    self.client,
+                    bulk_data,
+                    body,
+                    self.raise_on_exception,
+                    self.raise_on_error,
+                    **self.kwargs,
+                )
+                for success, info in results:
+                    if not success:
+                        logger.error(f"Doc failed: {info}")
+                        failed += 1
+                    else:
+                        if self.verbose:
+                            logger.debug(f"Doc OK: {info}")
+                        ok += 1
+            except BulkIndexError as e:
+                # Only the documents that failed are in the errors, the rest of the chunk was indexed
+                for info in e.errors:
+                    logger.error(f"Doc failed: {info}")
+                failed = len(e.errors)
+                ok = len(bulk_data) - failed
+                self.error = self.error or e
+            except Exception as e:
+                logger.error(f"Bulk request of {len(bulk_data)} documents failed: {e}")
+                failed = len(bulk_data)
+                self.error = self.error or e
+            finally:
+                with self.pending_changed:
+                    self.stats.update(ok=ok, failed=failed, requests=1)
+                    self.pending -= 1
+                    self.pending_changed.notify_all()
@@ -1,18 +1,17 @@
-from bs4 import BeautifulSoup
-from nlp import string_to_entities
+from nlp import string_to_entities, spans_to_entities, SPACES
+from html_text import strip_html
+from settings import entity_output
 
 
 def clean_text(input_string):
     """
-    Use Beautiful Soup to turn HTML into plaintext
+    Turn HTML into plaintext
 
     :param input_string: string (which might be HTML)
     :return: string (plaintext)
     """
     if input_string:
-        soup = BeautifulSoup(input_string, features="html.parser")
-        text = soup.get_text()
-        return text
+        return strip_html(input_string)
     return
 
 
@@ -35,26 +34,107 @@ def text_between(input_string, start_phrase):
         return
 
 
-def parse_description(description, spacy_nlp):
+def section_offsets(text, start_phrase):
     """
+    Find the section text_between would return, as offsets into the text
+
+    :param text:
+    :param start_phrase:
+    :return: (start, end), or None if the phrase isn't there or the section is empty
+    """
+    position = text.find(start_phrase)
+    if position < 0:
+        return
+    start = position + len(start_phrase)
+    end = text.find(".", start)
+    if end < 0:
+        end = len(text)
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    if start == end:
+        return
+    return start, end
+
+
+def section_output(ents):
+    """
+    :param ents: output of string_to_entities or spans_to_entities
+    :return: the entities grouped by type, or the compact list of entities
+    """
+    if "entities_by_type" in ents:
+        return ents["entities_by_type"]
+    return ents.get("entities", None)
+
+
+def section_entities(text, spans, start_phrase, offset):
+    """
+    The PERSON and ORG entities that the main parse found in a section of the description
+
+    :param text: the description, with the whitespace collapsed as in the main parse
+    :param spans: spans from the main parse, as (text, label, start, end)
+    :param start_phrase: e.g. Plaintiffs:
+    :param offset: where the description starts in the text of the main parse
+    :return: entities_by_type (or the compact entities), or None if the section is empty
+    """
+    bounds = section_offsets(text, start_phrase)
+    if not bounds:
+        return
+    start, end = bounds
+    section_spans = [
+        span for span in spans if span[2] >= offset + start and span[3] <= offset + end
+    ]
+    ents = spans_to_entities(
+        section_spans,
+        text[start:end],
+        ent_types=["PERSON", "ORG"],
+        compact=entity_output == "compact",
+    )
+    return section_output(ents)
+
+
+def parse_description(description, spacy_nlp, main_text=None, main_spans=None, plaintext=None):
+    """
+    Pull the short title, parties, subject and document type out of a Chancery description, e.g.
+
+        Short title: Newton v Smith. Plaintiffs: Isaac Newton. Defendants: Benjamin Smith. ...
+
+    If the text and spans of the main parse of the record are passed in, the entities for the plaintiffs and
+    defendants are taken from the main parse, rather than running spacy over each section again.
 
     :param description:
+    :param spacy_nlp:
+    :param main_text: text that analyse_text ran spacy over, which the description is part of
+    :param main_spans: spans from analyse_text
+    :param plaintext: the description with the markup already stripped, as enrich_records does for the main
+    parse, so that it isn't stripped again
     :return:
     """
-    text = clean_text(description)
+    text = plaintext if plaintext is not None else clean_text(description)
+    offset = -1
+    if text and main_text and main_spans is not None:
+        description_text = SPACES.sub(" ", text).strip()
+        offset = main_text.find(description_text)
     short_title = {"text": text_between(text, "Short title:")}
     plaintiffs = {"text": text_between(text, "Plaintiffs:")}
-    ents = string_to_entities(
-        input_string=text_between(text, "Plaintiffs:"), nlp=spacy_nlp, ent_types=["PERSON", "ORG"]
-    )
-    if ents:
-        plaintiffs["entities"] = ents.get("entities_by_type", None)
     defendants = {"text": text_between(text, "Defendants:")}
-    ents = string_to_entities(
-        input_string=text_between(text, "Defendants:"), nlp=spacy_nlp, ent_types=["PERSON", "ORG"]
-    )
-    if ents:
-        defendants["entities"] = ents.get("entities_by_type", None)
+    if offset >= 0:
+        for section, start_phrase in ((plaintiffs, "Plaintiffs:"), (defendants, "Defendants:")):
+            entities = section_entities(description_text, main_spans, start_phrase, offset)
+            if entities is not None:
+                section["entities"] = entities
+    else:
+        # The description couldn't be found in the main parse, so parse the sections on their own
+        for section, start_phrase in ((plaintiffs, "Plaintiffs:"), (defendants, "Defendants:")):
+            ents = string_to_entities(
+                input_string=text_between(text, start_phrase),
+                nlp=spacy_nlp,
+                ent_types=["PERSON", "ORG"],
+                plaintext=True,
+            )
+            if ents:
+                section["entities"] = section_output(ents)
     subject = {"text": text_between(text, "Subject:")}
     document_type = {"text": text_between(text, "Document type:")}
     data = dict(
@@ -1,18 +1,47 @@
 from datetime import datetime
 import calendar
+import re
 from collections import namedtuple
-import json
-import requests
+from functools import lru_cache
+import dateparser
+from static_cache import get_static
+
+MONTHS = {
+    name.lower(): number
+    for number in range(1, 13)
+    for name in (calendar.month_name[number], calendar.month_abbr[number])
+}
+MONTHS["sept"] = 9
+ORDINAL = r"(\d{1,2})(?:st|nd|rd|th)?"
+MONTH = r"([a-z]+)\.?"
+YEAR_ONLY = re.compile(r"(\d{4})")
+DAY_MONTH_YEAR = re.compile(rf"(?:the\s+)?{ORDINAL}(?:\s+of)?\s+{MONTH},?\s+(\d{{4}})", re.I)
+MONTH_DAY_YEAR = re.compile(rf"{MONTH}\s+{ORDINAL},?\s+(\d{{4}})", re.I)
+MONTH_YEAR = re.compile(rf"{MONTH},?\s+(\d{{4}})", re.I)
+# Dates written in running text, for extraction without spacy: 12 March 1845, March 12, 1845, March 1845,
+# and 1845-1850 (which is split into two dates, like a spacy date range)
+MONTH_NAME = "|".join(sorted(MONTHS, key=len, reverse=True))
+MENTION_YEAR = r"(?:1\d{3}|20\d{2})"
+DATE_MENTION = re.compile(
+    rf"\b(?:\d{{1,2}}(?:st|nd|rd|th)?\s+(?:of\s+)?(?:{MONTH_NAME})\.?,?\s+{MENTION_YEAR}"
+    rf"|(?:{MONTH_NAME})\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+{MENTION_YEAR}"
+    rf"|(?:{MONTH_NAME})\.?,?\s+{MENTION_YEAR}"
+    rf"|(?<![/.]){MENTION_YEAR}\s*-\s*{MENTION_YEAR}(?!/|\.\d))\b",
+    re.I,
+)
+# A year on its own, e.g. 1845, that isn't part of a reference or number such as 7/1234 or 1523/1614/42
+BARE_YEAR = re.compile(rf"(?<![\w/.-]){MENTION_YEAR}(?![\w/]|[.-]\d)")
+# What has to come before a year on its own for it to be taken as a date. Regimental and file numbers that
+# happen to be four digits don't have this, so they aren't dates.
+YEAR_CONTEXT = re.compile(
+    r"(?:\b(?:in|on|of|from|until|till|since|by|during|before|after|circa|c|ca|dated)\.?|-)\s*$",
+    re.I,
+)
 
 
 def parse_eras():
     era_data = {}
-    r = requests.get("https://alpha.nationalarchives.gov.uk/staticdata/eras.json")
-    if r.status_code == requests.codes.ok:
-        eras = r.json()
-    else:
-        with open("eras.json", "r") as f:
-            eras = json.load(f)
+    eras = get_static("eras.json", fallback="eras.json")
     for k, v in eras.items():
         era_start = datetime.strptime(v["start_date"], "%Y-%m-%d")
         era_end = datetime.strptime(v["end_date"], "%Y-%m-%d")
@@ -118,6 +147,147 @@ def gen_date(datestring, identifier, catalogue_ref):
             return fallback_date_parser(datestring)
 
 
+def date_mentions(text):
+    """
+    Find the dates in running text.
+
+    A year on its own is only taken as a date at the start of the text, where the covering dates are in the
+    flattened text, or after a preposition or a dash, e.g. "in 1845", "c. 1850", "Aug. - 1919".
+
+    :param text:
+    :return: list of (text, start, end)
+    """
+    mentions = [
+        (match.group(0), match.start(), match.end()) for match in DATE_MENTION.finditer(text)
+    ]
+    for match in BARE_YEAR.finditer(text):
+        start, end = match.span()
+        if any(start < m_end and m_start < end for _, m_start, m_end in mentions):
+            continue
+        if not text[:start].strip() or YEAR_CONTEXT.search(text[max(0, start - 12) : start]):
+            mentions.append((match.group(0), start, end))
+    return sorted(mentions, key=lambda mention: mention[1])
+
+
+def is_int(val):
+    try:
+        num = int(val)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_date_text(text):
+    """
+    Parse the common archival forms of date text without dateparser:
+
+        1845, 12 March 1845, 12th of March 1845, March 12, 1845, March 1845, Mar. 1845
+
+    :param text: text of a single date (the two sides of a range are parsed separately)
+    :return: (date, start, end) where date is the year (for year-only text) or the date, and start and end
+    are datetimes for the first and last day of the period; or None if the text isn't one of these forms
+    """
+    text = text.strip()
+    try:
+        match = YEAR_ONLY.fullmatch(text)
+        if match:
+            year = int(match.group(1))
+            return year, datetime(year, 1, 1), datetime(year, 12, 31)
+        match = DAY_MONTH_YEAR.fullmatch(text)
+        if match:
+            day, month, year = match.groups()
+        else:
+            match = MONTH_DAY_YEAR.fullmatch(text)
+            if match:
+                month, day, year = match.groups()
+        if match:
+            date = datetime(int(year), MONTHS[month.lower()], int(day))
+            return date, date, date
+        match = MONTH_YEAR.fullmatch(text)
+        if match:
+            month, year = MONTHS[match.group(1).lower()], int(match.group(2))
+            last_day = calendar.monthrange(year, month)[1]
+            return (
+                datetime(year, month, 1),
+                datetime(year, month, 1),
+                datetime(year, month, last_day),
+            )
+    except (KeyError, ValueError):
+        # Not a month name, or not a real date, e.g. 29 February 1845
+        pass
+    return
+
+
+def date_entity_dateparser(entity):
+    """
+    Make a DATE entity using dateparser, for text that parse_date_text can't handle
+
+    :param entity: text of a single date
+    :return: entity dict
+    """
+    try:
+        if is_int(entity):  # Handle cases where this is a year only, to avoid insertion of today
+            d = dateparser.parse(entity).year
+        else:
+            try:
+                if str(entity[0]) == "-":
+                    entity = str(entity[1:])
+                d = dateparser.parse(entity)
+            except (ValueError, IndexError):
+                d = None
+    except (ValueError, AttributeError):
+        d = None
+    if d:
+        try:
+            end_year = dateparser.parse(entity, settings={"RELATIVE_BASE": datetime(2020, 12, 31)})
+        except ValueError:
+            end_year = None
+        try:
+            start_year = dateparser.parse(entity, settings={"RELATIVE_BASE": datetime(2020, 1, 1)})
+        except ValueError:
+            start_year = None
+        if start_year and end_year:
+            return {
+                "text": entity,
+                "date": f"{d}",
+                "label": "DATE",
+                "year_start": start_year,
+                "year_end": end_year,
+            }
+    # Date parser couldn't identify the date, but we know it is one.
+    return {"text": entity, "label": "DATE"}
+
+
+@lru_cache(maxsize=50000)
+def cached_date_entity(entity):
+    parsed = parse_date_text(entity)
+    if parsed:
+        d, start, end = parsed
+        return {
+            "text": entity,
+            "date": f"{d}",
+            "label": "DATE",
+            "year_start": start,
+            "year_end": end,
+        }
+    return date_entity_dateparser(entity)
+
+
+def date_entity(entity):
+    """
+    Make a DATE entity, with the date and the start and end of the period it covers, e.g. for "March 1845":
+
+        {"text": "March 1845", "date": "1845-03-01 00:00:00", "label": "DATE",
+         "year_start": datetime(1845, 3, 1), "year_end": datetime(1845, 3, 31)}
+
+    Results are memoised by the text, as the same dates turn up over and over.
+
+    :param entity: text of a single date
+    :return: entity dict
+    """
+    return dict(cached_date_entity(entity))
+
+
 if __name__ == "__main__":
     a_, a = gen_date("09740101", "foo", "bar")
     b_, b = gen_date("14851231", "foo", "bar")
@@ -0,0 +1,140 @@
+"""
+Elasticsearch clients that compress their request bodies.
+
+The bulk bodies of enriched documents are mostly text, and go over HTTPS through the bastion tunnel, so they
+are compressed before sending: with gzip or deflate (settings.es_compression) at settings.es_compression_level.
+The bytes before and after compression are counted, see transfer_report.
+"""
+
+import gzip
+import threading
+import zlib
+from collections import Counter
+import certifi
+from elasticsearch import Elasticsearch, Urllib3HttpConnection
+from settings import es_host, es_port, es_compression, es_compression_level
+
+COMPRESSIONS = ("gzip", "deflate", "none")
+
+# Requests and bytes sent, since the last transfer_report
+transfer_stats = Counter()
+stats_lock = threading.Lock()
+
+# Clients by (host, port, verify_certs), see get_es_client
+clients = {}
+clients_lock = threading.Lock()
+
+
+def compress(body, compression="gzip", level=es_compression_level):
+    """
+    :param body: bytes
+    :param compression: gzip or deflate
+    :param level: 1 (fastest) to 9 (smallest)
+    :return: bytes
+    """
+    if compression == "deflate":
+        # HTTP deflate is the zlib format, which is what Elasticsearch expects
+        return zlib.compress(body, level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+class CompressedConnection(Urllib3HttpConnection):
+    """
+    Urllib3HttpConnection that compresses the request body with gzip or deflate at a given level, rather than
+    always using gzip at level 9 as http_compress does, and counts the bytes
+    """
+
+    def __init__(
+        self, compression=es_compression, compression_level=es_compression_level, **kwargs
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, expected one of {COMPRESSIONS}")
+        # http_compress asks for compressed responses, but the bodies are compressed in perform_request
+        super().__init__(http_compress=compression != "none", **kwargs)
+        self.http_compress = False
+        self.compression = compression
+        self.compression_level = compression_level
+
+    def perform_request(
+        self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None
+    ):
+        if body:
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            raw_size = len(body)
+            if self.compression != "none":
+                body = compress(body, self.compression, self.compression_level)
+                headers = dict(headers or {}, **{"content-encoding": self.compression})
+            with stats_lock:
+                transfer_stats["requests"] += 1
+                transfer_stats["raw_bytes"] += raw_size
+                transfer_stats["sent_bytes"] += len(body)
+        return super().perform_request(
+            method, url, params=params, body=body, timeout=timeout, ignore=ignore, headers=headers
+        )
+
+
+def make_es_client(
+    host=es_host,
+    port=es_port,
+    verify_certs=True,
+    compression=es_compression,
+    compression_level=es_compression_level,
+):
+    """
+    :param host: Elasticsearch host
+    :param port:
+    :param verify_certs: False for local running through the tunnel
+    :param compression: gzip, deflate or none
+    :param compression_level: 1 to 9
+    :return: Elasticsearch client
+    """
+    return Elasticsearch(
+        hosts=[
+            {
+                "host": host,
+                "use_ssl": True,
+                "verify_certs": verify_certs,
+                "port": port,
+                "ca_certs": certifi.where(),
+            }
+        ],
+        connection_class=CompressedConnection,
+        compression=compression,
+        compression_level=compression_level,
+    )
+
+
+def get_es_client(host=es_host, port=es_port, verify_certs=True):
+    """
+    Get the shared client for a cluster, making it the first time.
+
+    The clients are thread safe, and keep their connection pools (and TLS sessions) between requests.
+
+    :param host: Elasticsearch host
+    :param port:
+    :param verify_certs:
+    :return: Elasticsearch client
+    """
+    key = (host, str(port), verify_certs)
+    with clients_lock:
+        if key not in clients:
+            clients[key] = make_es_client(host=host, port=port, verify_certs=verify_certs)
+        return clients[key]
+
+
+def transfer_report(reset=True):
+    """
+    :param reset: start new counts afterwards, e.g. for the next lettercode
+    :return: string with the bytes sent before and after compression
+    """
+    with stats_lock:
+        raw = transfer_stats["raw_bytes"]
+        sent = transfer_stats["sent_bytes"]
+        report = (
+            f"{transfer_stats['requests']} requests, {raw / 1048576:.1f} MiB of which "
+            f"{sent / 1048576:.1f} MiB sent ({sent / raw if raw else 1.0:.1%})"
+        )
+        if reset:
+            transfer_stats.clear()
+    return report
@@ -1,7 +1,5 @@
-from elasticsearch import Elasticsearch
 from elasticsearch.helpers import parallel_bulk
 from elasticsearch.exceptions import NotFoundError
-import pyodbc
 import json
 from copy import deepcopy
 import requests
@@ -18,19 +16,23 @@ from ildb_queries import (
 from date_handling import gen_date, identify_eras, parse_eras
 import spacy
 from highlight_data import get_highlights
-from guides import load_guide_data, identify_guides
+from guides import identify_guides
+from static_cache import get_static
+from nlp import entity_cache, name_cache, slow_records_report
+from nlp_tiers import tier_report
+from bulk_writer import BulkWriter, bulk_actions
+from es_client import make_es_client, transfer_report
+from ildb_pool import connect_ildb
 from settings import (
-    ildb_host,
-    ildb_password,
-    ildb_port,
-    ildb_user,
     es_resolver_index,
-    es_port,
-    es_host,
     es_update,
+    ildb_chunk_size,
+    entity_cache_file,
+    name_cache_file,
+    bulk_serializer,
+    bulk_in_flight,
 )
 import logging
-import certifi
 from collections import OrderedDict
 from typing import Dict, Optional, Union, List, Tuple
 import time
@@ -48,18 +50,8 @@ es_logger.setLevel(logging.INFO)
 
 eras = parse_eras()
 
-g = requests.get("https://alpha.nationalarchives.gov.uk/staticdata/flattened_guides.json")
-if g.status_code == requests.codes.ok:
-    guides = g.json()
-else:
-    guides = None
-m = requests.get("https://alpha.nationalarchives.gov.uk/staticdata/researchguide_map.json")
-if m.status_code == requests.codes.ok:
-    integer_map = m.json()
-else:
-    integer_map = None
-if not guides and not integer_map:
-    guides, integer_map = load_guide_data()
+guides = get_static("flattened_guides.json", fallback="staticfiles/flattened_guides.json")
+integer_map = get_static("researchguide_map.json", fallback="staticfiles/researchguide_map.json")
 
 #  Just load a small taxonomy data file to initialise the global
 with gzip.open("taxonomy_datafiles/taxonomy_eu.json.gz", "rb") as f:
@@ -330,6 +322,9 @@ def p_bulk(es_, index_: str, iterator, chunk: int = 200, verbose: bool = True):
     The chunk size should be kept fairly small otherwise the amount of data being sent over the
     HTTP(S) transport is likely to cause ES to throw errors.
 
+    The actions are serialised with orjson by bulk_writer.bulk_actions, unless bulk_serializer is "client",
+    when the ES parallel bulk API and the client's JSON encoder are used.
+
     :param es_: ES connection
     :param index_: ES index to use
     :param iterator: Iterator which should yield docs
@@ -337,7 +332,8 @@ def p_bulk(es_, index_: str, iterator, chunk: int = 200, verbose: bool = True):
     :param verbose: boolean, if True, print every update status not just failures.
     :return:
     """
-    for success, info in parallel_bulk(
+    bulk = parallel_bulk if bulk_serializer == "client" else bulk_actions
+    for success, info in bulk(
         client=es_,
         actions=iterator,
         raise_on_error=True,
@@ -407,7 +403,7 @@ def get_matches(es_, es_index, path):
         return
 
 
-def cursor_get(database_connection, query_string, chunk_size=1000):
+def cursor_get(database_connection, query_string, chunk_size=ildb_chunk_size):
     """
     Iterate through a DB connection cursor adding to a list.
 
@@ -436,22 +432,29 @@ def cursor_get(database_connection, query_string, chunk_size=1000):
     return True
 
 
-def es_iterator(elastic, elastic_index, level, cursor_output, verbosity, ingest):
+def es_iterator(elastic, elastic_index, level, cursor_output, verbosity, ingest, writer=None):
     """
     Iterate the list of parsed (make_canonical({})) cursor output from ILDB and use
     Elastic search's parallel bulk ingest to push into ES
 
+    If there is a writer, the documents are added to it instead, and it sends them in the background while
+    the next chunk is fetched and enriched.
+
     :param elastic:
     :param elastic_index:
     :param level: level being indexed (for logging)
     :param cursor_output:
     :param verbosity:
     :param ingest:
+    :param writer: bulk_writer.BulkWriter shared by the levels and lettercodes
     :return:
     """
     es_logger.info(f"Bulk ingesting the canonical identifiers, level {level}")
     if ingest:
         for c in cursor_output:
+            if writer:
+                writer.add_many(ingest_list(item_list=c, index=elastic_index))
+                continue
             p_bulk(
                 es_=elastic,
                 index_=elastic_index,
@@ -473,6 +476,10 @@ def process_data(
     """
     Wrapper function to process departments into ES.
 
+    The documents go to Elasticsearch through a single BulkWriter, with bulk_in_flight requests at a time, which
+    is flushed after each lettercode and closed at the end, even if the caller stops reading part way through.
+    With bulk_in_flight=0 each chunk is sent with p_bulk instead.
+
     :param elastic: ES connection
     :param elastic_index: Index to use
     :param start: Integer. Start point in list
@@ -483,6 +490,54 @@ def process_data(
     :param ingest: boolean, if True, push into ES
     :return:
     """
+    writer = None
+    if ingest and bulk_in_flight:
+        writer = BulkWriter(elastic, verbose=verbosity, index=elastic_index, request_timeout=1000)
+    try:
+        return (
+            yield from process_lettercodes(
+                elastic,
+                elastic_index=elastic_index,
+                start=start,
+                end=end,
+                database_connection=database_connection,
+                lettercode=lettercode,
+                verbosity=verbosity,
+                ingest=ingest,
+                writer=writer,
+            )
+        )
+    finally:
+        if writer:
+            writer.close()
+            es_logger.info(f"Bulk writer: {writer.report()}")
+
+
+def process_lettercodes(
+    elastic,
+    elastic_index="test-index",
+    start=None,
+    end=None,
+    database_connection=False,
+    lettercode=None,
+    verbosity=None,
+    ingest=False,
+    writer=None,
+):
+    """
+    Process the lettercodes into ES, see process_data
+
+    :param elastic: ES connection
+    :param elastic_index: Index to use
+    :param start: Integer. Start point in list
+    :param end: Integer. End point in the list
+    :param database_connection: connection to ILDB
+    :param verbosity: pass to the bulk func
+    :param lettercode: single lettercode to pass in, to just ingest this lettercode
+    :param ingest: boolean, if True, push into ES
+    :param writer: BulkWriter, or None to bulk each chunk with p_bulk
+    :return:
+    """
     yield f"ES Update is set to {es_update}<br>"
     with open("config/update_mappings.json", "r") as mappings_file:
         es_index_settings = json.load(mappings_file)
@@ -577,9 +632,13 @@ def process_data(
             cursor_output=pieces_canonical,
             verbosity=verbosity,
             ingest=ingest,
+            writer=writer,
         )
         yield "Iterated records for pieces<br>"
         if ingest:
+            if writer:
+                # The level's documents are indexed before the index is refreshed
+                writer.flush()
             elastic.indices.put_settings(index=elastic_index, body=es_index_done_settings)
             time.sleep(sleep_time)
             elastic.indices.put_settings(index=elastic_index, body=es_index_settings)
@@ -595,9 +654,12 @@ def process_data(
             cursor_output=division_canonical,
             verbosity=verbosity,
             ingest=ingest,
+            writer=writer,
         )
         yield "Iterated records for divisions<br>"
         if ingest:
+            if writer:
+                writer.flush()
             elastic.indices.put_settings(index=elastic_index, body=es_index_done_settings)
             elastic.indices.put_settings(index=elastic_index, body=es_index_settings)
         subseries_canonical = cursor_get(
@@ -612,9 +674,12 @@ def process_data(
             cursor_output=subseries_canonical,
             verbosity=verbosity,
             ingest=ingest,
+            writer=writer,
         )
         yield "Iterated records for subseries<br>"
         if ingest:
+            if writer:
+                writer.flush()
             elastic.indices.put_settings(index=elastic_index, body=es_index_done_settings)
             elastic.indices.put_settings(index=elastic_index, body=es_index_settings)
         subsubseries_canonical = cursor_get(
@@ -629,9 +694,12 @@ def process_data(
             cursor_output=subsubseries_canonical,
             verbosity=verbosity,
             ingest=ingest,
+            writer=writer,
         )
         yield "Iterated records for subsubseries<br>"
         if ingest:
+            if writer:
+                writer.flush()
             elastic.indices.put_settings(index=elastic_index, body=es_index_done_settings)
             elastic.indices.put_settings(index=elastic_index, body=es_index_settings)
         items_canonical = cursor_get(
@@ -645,9 +713,12 @@ def process_data(
             cursor_output=items_canonical,
             verbosity=verbosity,
             ingest=ingest,
+            writer=writer,
         )
         yield "Iterated records for items<br>"
         if ingest:
+            if writer:
+                writer.flush()
             elastic.indices.put_settings(index=elastic_index, body=es_index_done_settings)
             time.sleep(sleep_time)
             elastic.indices.put_settings(index=elastic_index, body=es_index_settings)
@@ -663,9 +734,12 @@ def process_data(
             cursor_output=series_canonical,
             verbosity=verbosity,
             ingest=ingest,
+            writer=writer,
         )
         yield "Iterated records for series<br>"
         if ingest:
+            if writer:
+                writer.flush()
             elastic.indices.put_settings(index=elastic_index, body=es_index_done_settings)
             time.sleep(sleep_time)
             elastic.indices.put_settings(index=elastic_index, body=es_index_settings)
@@ -680,8 +754,29 @@ def process_data(
             cursor_output=lettercodes_canonical,
             verbosity=verbosity,
             ingest=ingest,
+            writer=writer,
         )
+        if writer:
+            # Everything for the lettercode is in Elasticsearch before it is reported as done
+            writer.flush()
+            yield f"Bulk writer: {writer.report()}<br>"
         yield "Done with indexing.<br>"
+        yield f"Entity cache: {entity_cache.report()}<br>"
+        transfer = transfer_report()
+        yield f"Bulk transfer: {transfer}<br>"
+        es_logger.info(f"Bulk transfer: {transfer}")
+        tiers = tier_report()
+        yield f"NLP tiers: {tiers}<br>"
+        es_logger.info(f"NLP tiers: {tiers}")
+        for line in slow_records_report():
+            yield f"{line}<br>"
+            es_logger.info(line)
+        es_logger.info(f"Entity cache: {entity_cache.report()}")
+        es_logger.info(f"Name variant cache: {name_cache.report()}")
+        if entity_cache_file:
+            entity_cache.save(entity_cache_file)
+        if name_cache_file:
+            name_cache.save(name_cache_file)
         if ingest:
             elastic.indices.put_settings(index=elastic_index, body=es_index_done_settings)
     if ingest:
@@ -703,27 +798,9 @@ if __name__ == "__main__":
     ch.setFormatter(formatter)
     es_logger.addHandler(ch)
     # Connect to ILDB
-    ildb_connection = pyodbc.connect(
-        server=ildb_host,
-        database="ILDB",
-        user=ildb_user,
-        tds_version="7.4",
-        password=ildb_password,
-        port=ildb_port,
-        driver="FreeTDS",
-    )
+    ildb_connection = connect_ildb()
     # Connect to ES
-    es = Elasticsearch(
-        hosts=[
-            {
-                "host": es_host,
-                "use_ssl": True,
-                "verify_certs": True,
-                "port": es_port,
-                "ca_certs": certifi.where(),
-            }
-        ]
-    )
+    es = make_es_client()
     print(f"{es}")
     print("Processing data")
     process_data(
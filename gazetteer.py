@@ -0,0 +1,74 @@
+"""
+Place extraction against a lookup that is built once, from the GeoText city, country and nationality data and,
+optionally, a list of archival place names (historic counties etc.) in staticfiles/archival_places.json.
+
+GeoText(text) finds the candidate words with a regex and then checks each against the three tables in turn for
+every text. country_mentions does the same candidate match, but with a single lookup per candidate that already
+holds the country, city and nationality codes, and returns the same codes in the same order.
+"""
+
+import json
+import re
+from collections import Counter
+from geotext import GeoText
+from settings import archival_places
+
+archival_places_file = "staticfiles/archival_places.json"
+
+# The candidate pattern GeoText uses: capitalised words, e.g. London, New York, Rio de Janeiro
+CANDIDATE = re.compile(r"[A-ZÀ-Ú]+[a-zà-ú]+[ \-]?(?:d[a-u].)?(?:[A-ZÀ-Ú]+[a-zà-ú]+)*")
+
+
+def build_place_index(extra_places=None):
+    """
+    Build the lookup from lowercased place name to its (country, city, nationality) codes
+
+    :param extra_places: dict of place name to country code. These are treated like the GeoText city patches,
+    so they replace any city of the same name.
+    :return: dict
+    """
+    index = GeoText.index
+    cities = dict(index.cities)
+    if extra_places:
+        cities.update({name.lower(): code for name, code in extra_places.items()})
+    place_index = {}
+    for name in set(index.countries) | set(cities) | set(index.nationalities):
+        country = index.countries.get(name)
+        # Country names are not considered cities
+        city = cities.get(name) if country is None else None
+        place_index[name] = (country, city, index.nationalities.get(name))
+    return place_index
+
+
+def load_archival_places(path=archival_places_file):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+place_index = build_place_index(load_archival_places() if archival_places else None)
+
+
+def country_mentions(text, lookup=None):
+    """
+    Country codes for the places mentioned in a text, most mentioned first, as GeoText(text).country_mentions
+
+    :param text:
+    :param lookup: place index, defaults to the one built at import
+    :return: list of country codes
+    """
+    lookup = lookup or place_index
+    countries = []
+    cities = []
+    nationalities = []
+    for candidate in CANDIDATE.findall(text):
+        codes = lookup.get(candidate.strip().lower())
+        if codes:
+            country, city, nationality = codes
+            if country is not None:
+                countries.append(country)
+            if city is not None:
+                cities.append(city)
+            if nationality is not None:
+                nationalities.append(nationality)
+    # GeoText counts the countries, then the cities, then the nationalities, which decides the order of ties
+    return [code for code, _ in Counter(countries + cities + nationalities).most_common()]
@@ -1,6 +1,6 @@
 import json
 from collections import defaultdict
-import requests
+from static_cache import get_static
 
 
 test = {
@@ -132,18 +132,9 @@ def get_guidefile():
 
 
 def invert_guides():
-    g = requests.get("https://alpha.nationalarchives.gov.uk/staticdata/flattened_guides.json")
-    if g.status_code == requests.codes.ok:
-        guides = g.json()
-    else:
-        guides = None
-    m = requests.get("https://alpha.nationalarchives.gov.uk/staticdata/researchguide_map.json")
-    if m.status_code == requests.codes.ok:
-        integer_map = m.json()
-    else:
-        integer_map = None
-    if not guides and not integer_map:
-        guides, integer_map = load_guide_data()
+    integer_map = get_static(
+        "researchguide_map.json", fallback="staticfiles/researchguide_map.json"
+    )
     # print(json.dumps(integer_map, indent=2, sort_keys=True))
     inverted = {v["id"]: {"key": int(k), "title": v["title"]} for k, v in integer_map.items()}
     with open("staticfiles/decorated_guides.json", "r") as rf:
@@ -0,0 +1,84 @@
+"""
+Turn the EAD/HTML snippets that Kentigern returns, e.g. <scopecontent><p>...</p></scopecontent>, into plain text.
+
+The tags are removed with a compiled pattern and the entities unescaped, giving the same text as
+BeautifulSoup(input_string, features="html.parser").get_text() without building a tree. Anything that looks like
+a broken tag, which html.parser has its own rules for, is handed to BeautifulSoup.
+"""
+
+import html
+import re
+from bs4 import BeautifulSoup
+from bs4.dammit import EntitySubstitution
+
+# Comments, declarations and processing instructions, and start and end tags (allowing ">" in quoted values)
+MARKUP = re.compile(
+    r"<!--.*?-->|<[!?][^>]*>|</?[a-zA-Z][^\s/>]*(?:[^>\"']|\"[^\"]*\"|'[^']*')*>", re.S
+)
+ASCII_SPACES = " \n\t\f\r"
+# Elements whose text BeautifulSoup treats differently: pre and textarea keep their whitespace, and the
+# contents of script, style and template are left out of get_text()
+SPECIAL_ELEMENTS = re.compile(r"<(?:pre|textarea|script|style|template)\b", re.I)
+# What is left of a tag that couldn't be matched
+BROKEN_MARKUP = re.compile(r"<[a-zA-Z/!?]")
+# Terminated character references, which html.unescape and BeautifulSoup turn into the same characters.
+# Unterminated ones, and numeric ones for control characters, are left to BeautifulSoup.
+CHARREF = re.compile(r"&(?:#([0-9]{1,7})|#[xX]([0-9a-fA-F]{1,6})|([a-zA-Z][a-zA-Z0-9]*));")
+NAMED_REFS = {
+    name
+    for name, character in EntitySubstitution.HTML_ENTITY_TO_CHARACTER.items()
+    if html.unescape(f"&{name};") == character
+}
+
+
+def strip_html_soup(input_string):
+    soup = BeautifulSoup(input_string, features="html.parser")
+    return soup.get_text()
+
+
+def is_safe_charref(match):
+    decimal, hexadecimal, name = match.groups()
+    if name:
+        return name in NAMED_REFS
+    codepoint = int(decimal) if decimal else int(hexadecimal, 16)
+    return 32 <= codepoint < 127 or 160 <= codepoint < 0xD800
+
+
+def unescape_text(text):
+    """
+    Unescape a run of text between tags
+
+    :param text:
+    :return: the text, or None if it has a reference that BeautifulSoup might treat differently
+    """
+    if "&" not in text:
+        return text
+    matches = [m for m in CHARREF.finditer(text)]
+    if len(matches) != text.count("&") or not all(is_safe_charref(m) for m in matches):
+        return
+    return html.unescape(text)
+
+
+def strip_html(input_string):
+    """
+    Turn HTML into plaintext
+
+    :param input_string: string (which might be HTML)
+    :return: string (plaintext), or None if there was no input
+    """
+    if not input_string:
+        return
+    if "<![" in input_string or SPECIAL_ELEMENTS.search(input_string):
+        # CDATA sections keep their text
+        return strip_html_soup(input_string)
+    # Unescape each run of text on its own, as html.parser does, so that entities can't span a tag
+    texts = []
+    for part in MARKUP.split(input_string):
+        text = unescape_text(part)
+        if text is None or BROKEN_MARKUP.search(part):
+            return strip_html_soup(input_string)
+        if text and not text.strip(ASCII_SPACES):
+            # BeautifulSoup collapses whitespace-only strings
+            text = "\n" if "\n" in text else " "
+        texts.append(text)
+    return "".join(texts)
@@ -0,0 +1,116 @@
+"""
+Pool of ILDB connections, so that each ingest request doesn't pay for a new connection to MS SQL.
+
+A connection is checked with SELECT 1 when it is taken from the pool, and replaced by a new one if it has
+gone away, e.g. after the server or the tunnel dropped it while it sat idle.
+"""
+
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+import pyodbc
+from settings import ildb_host, ildb_password, ildb_port, ildb_user, ildb_pool_size
+
+logger = logging.getLogger("")
+
+
+def connect_ildb():
+    return pyodbc.connect(
+        server=ildb_host,
+        database="ILDB",
+        user=ildb_user,
+        tds_version="7.4",
+        password=ildb_password,
+        port=ildb_port,
+        driver="FreeTDS",
+    )
+
+
+def is_alive(connection):
+    """
+    :param connection: pyodbc connection
+    :return: True if the connection can still run a query
+    """
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        return True
+    except pyodbc.Error:
+        return False
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except pyodbc.Error:
+        pass
+
+
+class ConnectionPool:
+    def __init__(self, connect=connect_ildb, size=ildb_pool_size):
+        """
+        :param connect: function that makes a new connection
+        :param size: most idle connections to keep. This doesn't limit the connections in use; more are made
+        when the pool is empty, and closed when they come back to a full pool.
+        """
+        self.connect = connect
+        self.size = size
+        # The most recently used connection is the likeliest to still be alive
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.opened = 0
+
+    def new_connection(self):
+        connection = self.connect()
+        with self.lock:
+            self.opened += 1
+        return connection
+
+    def acquire(self):
+        """
+        Take a live connection from the pool, or make a new one
+
+        :return: pyodbc connection
+        """
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                return self.new_connection()
+            if is_alive(connection):
+                return connection
+            logger.info("Replacing a dead ILDB connection")
+            close_quietly(connection)
+
+    def release(self, connection):
+        """
+        Give a connection back to the pool, closing it if the pool is full
+
+        :param connection:
+        :return:
+        """
+        if self.idle.qsize() < self.size:
+            self.idle.put(connection)
+        else:
+            close_quietly(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self):
+        while True:
+            try:
+                close_quietly(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+ildb_pool = ConnectionPool()
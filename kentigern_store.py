@@ -0,0 +1,110 @@
+"""
+Local store of Kentigern records, so that a lettercode can be re-run without fetching its Mongo data again.
+
+Each record is stored gzipped under the sha1 of its level and id, sharded on the first two pairs of hex digits:
+
+    <kentigern_store_dir>/ab/cd/abcd1234....json.gz
+
+Ids that Kentigern had no record for are stored as null, so that a replay doesn't try to fetch them.
+
+Modes (settings.kentigern_store_mode):
+
+    off          - always fetch from Kentigern (the default)
+    record       - always fetch from Kentigern, and store what comes back
+    replay       - only read from the store; Kentigern is never called
+    read-through - read from the store, and fetch and store anything that isn't there
+"""
+
+import gzip
+import hashlib
+import json
+import os
+from collections import Counter
+from settings import kentigern_store_dir
+from static_cache import write_atomic
+
+MODES = ("off", "record", "replay", "read-through")
+
+# Running totals of store hits, misses and writes
+store_stats = Counter()
+
+
+def store_path(doc_id, level, store_dir=kentigern_store_dir):
+    """
+    Path to the stored record for an id and level
+
+    :param doc_id: canonical id, e.g. C:~1:9:~1:2
+    :param level: e.g. Piece
+    :param store_dir:
+    :return:
+    """
+    digest = hashlib.sha1(f"{level}|{doc_id}".encode("utf-8")).hexdigest()
+    return os.path.join(store_dir, digest[0:2], digest[2:4], f"{digest}.json.gz")
+
+
+def read_record(doc_id, level, store_dir=kentigern_store_dir):
+    """
+    Read a record from the store
+
+    :param doc_id:
+    :param level:
+    :param store_dir:
+    :return: (found, record). record is None if Kentigern had no data for this id.
+    """
+    try:
+        with open(store_path(doc_id, level, store_dir=store_dir), "rb") as f:
+            return True, json.loads(gzip.decompress(f.read()))
+    except (OSError, ValueError, EOFError):
+        return False, None
+
+
+def write_record(doc_id, level, record, store_dir=kentigern_store_dir):
+    """
+    Write a record (or None, if Kentigern had no data for this id) to the store
+
+    :param doc_id:
+    :param level:
+    :param record: Kentigern record, or None
+    :param store_dir:
+    :return:
+    """
+    path = store_path(doc_id, level, store_dir=store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, gzip.compress(json.dumps(record).encode("utf-8"), compresslevel=6))
+    store_stats["writes"] += 1
+
+
+def lookup(ids, store_dir=kentigern_store_dir):
+    """
+    Look up a list of ids in the store
+
+    :param ids: list of {"id": ..., "level": ...} dicts, as sent to Kentigern
+    :param store_dir:
+    :return: (ids that aren't in the store, records that are)
+    """
+    missing = []
+    records = []
+    for i in ids:
+        found, record = read_record(i["id"], i["level"], store_dir=store_dir)
+        if found:
+            store_stats["hits"] += 1
+            if record:
+                records.append(record)
+        else:
+            store_stats["misses"] += 1
+            missing.append(i)
+    return missing, records
+
+
+def save_missing(ids, seen, store_dir=kentigern_store_dir):
+    """
+    Store a null for every id in a request that Kentigern returned no record for
+
+    :param ids: list of {"id": ..., "level": ...} dicts, as sent to Kentigern
+    :param seen: set of the ids that Kentigern did return
+    :param store_dir:
+    :return:
+    """
+    for i in ids:
+        if i["id"] not in seen:
+            write_record(i["id"], i["level"], None, store_dir=store_dir)
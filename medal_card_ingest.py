@@ -0,0 +1,151 @@
+"""
+Ingest the WO 372 medal cards into Elasticsearch, spreading the pieces over a pool of worker processes.
+
+Each worker has its own Kentigern session, spacy model and Elasticsearch client. It sends a piece's documents
+through a BulkWriter, and writes a checkpoint once they are all indexed, so that a re-run skips the pieces that
+are already done.
+
+There is no taxonomy shard for WO in taxonomy_datafiles, so the medal cards get no subjects.
+
+    python medal_card_ingest.py --first 1 --last 29 --processes 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from multiprocessing import Pool
+import requests
+import es_docs
+import mongo_grabber
+from bulk_writer import BulkWriter
+from es_docs import ingest_list
+from es_client import make_es_client
+from mongo_grabber import medal_cards
+from static_cache import write_atomic
+from settings import bulk_in_flight, es_resolver_index, medal_card_checkpoint_dir
+
+logger = logging.getLogger("")
+
+es_index_done_settings = {"settings": {"index": {"refresh_interval": "10s"}}}
+es_index_settings = {"settings": {"index": {"refresh_interval": "-1"}}}
+
+# Per-process state, set up by init_worker
+worker = {}
+
+
+def checkpoint_path(piece, checkpoint_dir=medal_card_checkpoint_dir):
+    return os.path.join(checkpoint_dir, f"WO_372_{piece}.json")
+
+
+def init_worker(es_index):
+    """
+    Set up the clients for a worker process.
+
+    The spacy model is the one es_docs loads when it is imported, which each worker has its own copy of.
+
+    :param es_index: Elasticsearch index to ingest into
+    :return:
+    """
+    worker["es"] = make_es_client()
+    worker["index"] = es_index
+    worker["nlp"] = es_docs.nlp
+    mongo_grabber.kentigern_session = requests.Session()
+
+
+def ingest_piece(piece):
+    """
+    Harvest and ingest the medal cards for a single piece of WO 372
+
+    :param piece: piece number
+    :return: dict summarising the piece
+    """
+    checkpoint = checkpoint_path(piece)
+    if os.path.exists(checkpoint):
+        with open(checkpoint, "r") as f:
+            summary = json.load(f)
+        summary["skipped"] = True
+        return summary
+    start = time.time()
+    records = 0
+    try:
+        # Closing the writer waits for the piece's documents, and raises if any failed to index
+        with BulkWriter(
+            worker["es"],
+            in_flight=max(bulk_in_flight, 1),
+            index=worker["index"],
+            request_timeout=1000,
+        ) as writer:
+            for chunk in medal_cards(spacy_nlp=worker["nlp"], piece=piece):
+                writer.add_many(ingest_list(item_list=chunk, index=worker["index"]))
+                records += len(chunk)
+                logger.info(f"Piece {piece}: {records} records queued")
+        logger.info(f"Piece {piece}: {writer.report()}")
+    except Exception as e:
+        # Don't write a checkpoint, so that the piece is retried on the next run
+        logger.exception(f"Piece {piece} failed after {records} records")
+        return {"piece": piece, "records": records, "error": str(e)}
+    summary = {
+        "piece": piece,
+        "records": records,
+        "seconds": round(time.time() - start, 1),
+        "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+    write_atomic(checkpoint, json.dumps(summary).encode("utf-8"))
+    return summary
+
+
+def ingest_medal_cards(pieces, processes=4, es_index=es_resolver_index):
+    """
+    Ingest a list of pieces using a pool of worker processes
+
+    :param pieces: list of piece numbers
+    :param processes: number of worker processes
+    :param es_index: Elasticsearch index to ingest into
+    :return: list of per-piece summaries
+    """
+    es = make_es_client()
+    es.indices.put_settings(index=es_index, body=es_index_settings)
+    summaries = []
+    try:
+        with Pool(processes=processes, initializer=init_worker, initargs=(es_index,)) as pool:
+            for summary in pool.imap_unordered(ingest_piece, pieces):
+                summaries.append(summary)
+                if summary.get("skipped"):
+                    status = "already done"
+                elif summary.get("error"):
+                    status = f"failed: {summary['error']}"
+                else:
+                    status = f"{summary['records']} records in {summary['seconds']}s"
+                logger.info(
+                    f"Piece {summary['piece']} ({len(summaries)} of {len(pieces)}): {status}"
+                )
+    finally:
+        es.indices.put_settings(index=es_index, body=es_index_done_settings)
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the WO 372 medal cards")
+    parser.add_argument("--first", type=int, default=1, help="first piece")
+    parser.add_argument("--last", type=int, default=29, help="last piece")
+    parser.add_argument("--processes", type=int, default=4, help="number of worker processes")
+    parser.add_argument("--index", default=es_resolver_index, help="Elasticsearch index")
+    args = parser.parse_args()
+    logger.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setFormatter(
+        logging.Formatter("%(asctime)s - %(processName)s - %(levelname)s - %(message)s")
+    )
+    logger.addHandler(ch)
+    results = ingest_medal_cards(
+        pieces=list(range(args.first, args.last + 1)),
+        processes=args.processes,
+        es_index=args.index,
+    )
+    failed = [r["piece"] for r in results if r.get("error")]
+    logger.info(f"Ingested {sum(r['records'] for r in results)} medal card records")
+    if failed:
+        logger.error(f"Failed pieces (re-run to retry): {sorted(failed)}")
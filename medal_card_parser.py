@@ -0,0 +1,358 @@
+"""
+Fast extraction of the person and medal details from the EAD markup in WO 372 medal card descriptions, e.g.
+
+    <scopecontent><p>Medal card of <persname><emph altrender="surname">Smith</emph>,
+    <emph altrender="forenames">John</emph></persname> Corps Regiment No Rank
+    <emph altrender="medal"><corpname>Royal Field Artillery</corpname>
+    <emph altrender="regno">12345</emph> <emph altrender="rank">Gunner</emph></emph></p></scopecontent>
+
+Rather than building a BeautifulSoup tree for every card, the markup is tokenised with a compiled pattern
+and the fields are picked out as the tags go past. The output is the same as the BeautifulSoup version,
+extract_medal_card_details_soup, which is kept so that the two can be checked against each other. Markup that
+html.parser has to recover from, such as a tag or comment that isn't closed properly, is left to it, as
+html_text.strip_html does, since how it recovers varies between Python versions.
+"""
+
+import re
+from bs4 import BeautifulSoup, Tag
+from html_text import SPECIAL_ELEMENTS, unescape_text
+
+# As html_text.MARKUP, with the parts of a tag in groups, and the text between tags
+TOKEN = re.compile(
+    r"<!--.*?-->|<[!?][^>]*>|<(/?)([a-zA-Z][^\s/>]*)((?:[^>\"']|\"[^\"]*\"|'[^']*')*)>"
+    r"|(?:[^<]|<(?![a-zA-Z/!?]))+|(<)",
+    re.S,
+)
+# Comments, declarations and processing instructions
+TOKEN_SPECIAL = re.compile(r"<!--.*?-->|<[!?][^>]*>", re.S)
+# A comment that every version of html.parser ends in the same place, without "--" inside it
+REGULAR_COMMENT = re.compile(r"<!--(?!-?>)(?:(?!--).)*-->", re.S)
+ASCII_SPACES = " \n\t\f\r"
+ALTRENDER = re.compile(r"""altrender\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))""", re.I)
+VOID_ELEMENTS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "wbr"}
+
+# The elements that hold each field, as (tag, altrender), and the record type they belong to
+PERSON_FIELDS = {("emph", "forenames"): "forenames", ("emph", "surname"): "surname"}
+MEDAL_FIELDS = {
+    ("corpname", None): "corps",
+    ("emph", "regno"): "regiment_no",
+    ("emph", "rank"): "rank",
+}
+
+
+def tokenise(html_string):
+    """
+    :param html_string:
+    :return: generator of TOKEN matches
+    :raises IrregularMarkup: for a tag that isn't closed, e.g. by an unterminated quote, a malformed comment, a
+    CDATA section or an element whose content html.parser doesn't parse as markup, such as script
+    """
+    if SPECIAL_ELEMENTS.search(html_string):
+        raise IrregularMarkup(SPECIAL_ELEMENTS.search(html_string).group(0))
+    for match in TOKEN.finditer(html_string):
+        token = match.group(0)
+        if match.group(4) is not None or "<" in (match.group(3) or ""):
+            raise IrregularMarkup(html_string[match.start() : match.start() + 20])
+        if token.startswith(("<!-", "<![")) and not REGULAR_COMMENT.fullmatch(token):
+            raise IrregularMarkup(token[:20])
+        yield match
+
+
+class EmptyElement(ValueError):
+    """
+    A field element has no content. The BeautifulSoup version fails on the whole card in this case.
+    """
+
+
+class IrregularMarkup(ValueError):
+    """
+    Markup that html.parser recovers from in its own way, which is left to the BeautifulSoup version
+    """
+
+
+def parse_medal_card(html_string):
+    """
+    Extract the person and medal details from the markup for a single medal card
+
+    :param html_string: EAD markup from scope_and_content.description
+    :return: dict with "person" and "details"
+    :raises EmptyElement: if a field element is empty
+    :raises IrregularMarkup: see tokenise
+    """
+    persons = []
+    medals = []
+    # Each open element is (name, (type, record) if it opened a record, capture it is the source of)
+    stack = []
+    # The capture waiting for the first child of the element that has just opened
+    pending = None
+    # Captures collecting the text of a first child that is itself an element, with the child's depth
+    collecting = []
+    for match in tokenise(html_string):
+        token = match.group(0)
+        name = match.group(2)
+        if name is None and TOKEN_SPECIAL.match(token):
+            # Comments, declarations and processing instructions aren't text, but when one is the first
+            # child of a field BeautifulSoup returns it. They are rare, so parse just those.
+            if pending is not None:
+                nodes = BeautifulSoup(token, "html.parser").contents
+                if nodes:
+                    pending["value"] = str(nodes[0])
+                    pending = None
+            continue
+        if name is None:
+            text = unescape_text(token)
+            if text is None:
+                raise IrregularMarkup("character reference")
+            if not text.strip(ASCII_SPACES):
+                # BeautifulSoup collapses whitespace-only strings
+                text = "\n" if "\n" in text else " "
+            for capture, _ in collecting:
+                capture["value"] += text
+            if pending is not None:
+                pending["value"] = text
+                pending = None
+            continue
+        end_tag, attrs = match.group(1, 3)
+        name = name.lower()
+        # An end tag closes everything up to the last open element of that name
+        if end_tag:
+            for position in range(len(stack) - 1, -1, -1):
+                if stack[position][0] == name:
+                    break
+            else:
+                continue
+            for closed_name, _, capture in reversed(stack[position:]):
+                if capture is not None and capture is pending:
+                    raise EmptyElement(closed_name)
+            collecting = [(capture, depth) for capture, depth in collecting if depth < position]
+            del stack[position:]
+            continue
+        void = attrs.rstrip().endswith("/") or name in VOID_ELEMENTS
+        if pending is not None:
+            # The first child of the element is an element, so use its text
+            pending["value"] = ""
+            if not void:
+                collecting.append((pending, len(stack)))
+            pending = None
+        altrender = ALTRENDER.search(attrs) if "altrender" in attrs.lower() else None
+        if altrender:
+            altrender = next(g for g in altrender.groups() if g is not None)
+        capture = None
+        key = (name, altrender if name == "emph" else None)
+        for kind, fields in (("person", PERSON_FIELDS), ("medal", MEDAL_FIELDS)):
+            field = fields.get(key)
+            if field:
+                # find() takes the first matching descendant, so only fill fields that aren't set yet
+                for _, record, _ in stack:
+                    if record is not None and record[0] == kind and field not in record[1]:
+                        if capture is None:
+                            capture = {"value": None}
+                        record[1][field] = capture
+        opened = None
+        if name == "persname":
+            opened = ("person", {})
+            persons.append(opened[1])
+        elif name == "emph" and altrender == "medal":
+            opened = ("medal", {})
+            medals.append(opened[1])
+        if void:
+            if capture is not None:
+                raise EmptyElement(name)
+            continue
+        if capture is not None:
+            pending = capture
+        stack.append((name, opened, capture))
+    if pending is not None:
+        raise EmptyElement("unclosed")
+    details = dict(person={}, details=[])
+    if persons:
+        person = persons[-1]
+        forenames = person["forenames"]["value"] if "forenames" in person else None
+        surname = person["surname"]["value"] if "surname" in person else None
+        details["person"] = {
+            "forenames": forenames,
+            "surname": surname,
+            "combined_name": f"{forenames} {surname}",
+        }
+    for medal in medals:
+        details["details"].append(
+            {
+                field: medal[field]["value"] if field in medal else None
+                for field in ("corps", "regiment_no", "rank")
+            }
+        )
+    return details
+
+
+def extract_medal_card_details(mongo_object):
+    """
+    Add the details parsed from the medal card markup to the object as "medal_card"
+
+    :param mongo_object: object decorated with Mongo data
+    :return: the same object
+    """
+    try:
+        html_string = mongo_object["mongo"]["scope_and_content"]["description"]
+    except (KeyError, TypeError):
+        return mongo_object
+    if isinstance(html_string, str):
+        try:
+            mongo_object["medal_card"] = parse_medal_card(html_string)
+        except EmptyElement:
+            pass
+        except IrregularMarkup:
+            details = soup_details(html_string)
+            if details:
+                mongo_object["medal_card"] = details
+    return mongo_object
+
+
+def extract_medal_card_details_batch(mongo_objects):
+    """
+    Add the medal card details to a list of objects
+
+    :param mongo_objects: list of objects decorated with Mongo data
+    :return: list of the same objects
+    """
+    return [extract_medal_card_details(m) for m in mongo_objects]
+
+
+def extract_medal_card_details_soup(mongo_object):
+    """
+    The original BeautifulSoup extraction, kept as the reference for check_conformance
+
+    :param mongo_object:
+    :return:
+    """
+    html_string = mongo_object["mongo"]["scope_and_content"]["description"]
+    try:
+        soup = BeautifulSoup(html_string, "html.parser")
+        details = dict(person={}, details=[])
+        for person in soup.find_all("persname"):
+            try:
+                details["person"]["forenames"] = person.find(
+                    "emph", {"altrender": "forenames"}
+                ).contents[0]
+            except AttributeError or IndexError:
+                details["person"]["forenames"] = None
+            try:
+                details["person"]["surname"] = person.find(
+                    "emph", {"altrender": "surname"}
+                ).contents[0]
+            except AttributeError or IndexError:
+                details["person"]["surname"] = None
+            details["person"][
+                "combined_name"
+            ] = f'{details["person"]["forenames"]} {details["person"]["surname"]}'
+        for detail in soup.find_all("emph", {"altrender": "medal"}):
+            try:
+                corps = detail.find("corpname").contents[0]
+            except AttributeError or IndexError:
+                corps = None
+            try:
+                regiment_no = detail.find("emph", {"altrender": "regno"}).contents[0]
+            except AttributeError or IndexError:
+                regiment_no = None
+            try:
+                rank = detail.find("emph", {"altrender": "rank"}).contents[0]
+            except AttributeError or IndexError:
+                rank = None
+            details["details"].append({"corps": corps, "regiment_no": regiment_no, "rank": rank})
+        mongo_object["medal_card"] = details
+        return mongo_object
+    except:
+        return mongo_object
+
+
+def soup_value(value):
+    """
+    Turn a value from the BeautifulSoup extraction into a plain string. Where the first child of a field
+    was an element, the soup version returned the Tag itself, and the fast version returns its text.
+    """
+    if isinstance(value, Tag):
+        return value.get_text()
+    return value if value is None else str(value)
+
+
+def wrap_description(html_string):
+    return {"mongo": {"scope_and_content": {"description": html_string}}}
+
+
+def soup_details(html_string):
+    """
+    The BeautifulSoup extraction, with the values as plain strings
+
+    :param html_string: medal card description
+    :return: dict with "person" and "details", or None if the BeautifulSoup version failed
+    """
+    details = extract_medal_card_details_soup(wrap_description(html_string)).get("medal_card")
+    if details:
+        person = {k: soup_value(v) for k, v in details["person"].items()}
+        if person:
+            person["combined_name"] = f'{person["forenames"]} {person["surname"]}'
+        details = {
+            "person": person,
+            "details": [{k: soup_value(v) for k, v in d.items()} for d in details["details"]],
+        }
+    return details
+
+
+def check_conformance(html_strings):
+    """
+    Compare the fast extraction with the BeautifulSoup extraction
+
+    :param html_strings: list of medal card descriptions
+    :return: list of (html_string, soup output, fast output) for every description where they differ
+    """
+    mismatches = []
+    for html_string in html_strings:
+        expected = soup_details(html_string)
+        actual = extract_medal_card_details(wrap_description(html_string)).get("medal_card")
+        if expected != actual:
+            mismatches.append((html_string, expected, actual))
+    return mismatches
+
+
+samples = [
+    '<scopecontent><p>Medal card of <persname><emph altrender="surname">Smith</emph>, '
+    '<emph altrender="forenames">John</emph></persname> Corps Regiment No Rank '
+    '<emph altrender="medal"><corpname>Royal Field Artillery</corpname> '
+    '<emph altrender="regno">12345</emph> <emph altrender="rank">Gunner</emph></emph></p>'
+    "</scopecontent>",
+    '<scopecontent><p>Medal card of <persname><emph altrender="surname">O&apos;Brien</emph>, '
+    '<emph altrender="forenames">Patrick J</emph></persname> Corps Regiment No Rank '
+    '<emph altrender="medal"><corpname>Royal Irish Rifles</corpname> '
+    '<emph altrender="regno">7/1234</emph> <emph altrender="rank">Private</emph></emph> '
+    '<emph altrender="medal"><corpname>Labour Corps</corpname> '
+    '<emph altrender="regno">456789</emph> <emph altrender="rank">Private</emph></emph></p>'
+    "</scopecontent>",
+    '<scopecontent><p>Medal card of <persname><emph altrender="surname">Jones</emph>'
+    "</persname> Corps Regiment No Rank "
+    '<emph altrender="medal"><corpname>Army Service Corps</corpname> '
+    '<emph altrender="regno"></emph> <emph altrender="rank">Driver</emph></emph></p>'
+    "</scopecontent>",
+    "<scopecontent><p>Medal card of <persname>Unknown</persname></p></scopecontent>",
+    "Medal card of Smith, John",
+    # A ">" inside a quoted attribute value
+    '<persname><emph title="a>b" altrender="surname">Smith</emph></persname> '
+    '<emph altrender="medal"><corpname title="1>2">Royal Engineers</corpname></emph>',
+    # A comment or processing instruction as the first child of a field
+    '<persname><emph altrender="surname"><!-- checked -->Smith</emph>'
+    '<emph altrender="forenames"><?pi x?>John</emph></persname>',
+    # A "<" that doesn't start a tag
+    '<persname><emph altrender="surname">< Smith</emph></persname><emph altrender="rank">a<b</emph>',
+    # Left to BeautifulSoup: an unterminated quote, a comment html.parser versions end differently, a
+    # reference without its semicolon, an end tag with a space and a "<" that might start a tag
+    '<persname><emph altrender="surname>Smith</emph><emph altrender="forenames">John</emph></persname>',
+    '<persname><emph altrender="surname"><!-->Smith--></emph></persname>',
+    '<emph altrender="medal"><corpname>Royal &ampArtillery</corpname></emph>',
+    '<persname><emph altrender="surname">Smith</ emph></persname>',
+    '<persname><emph altrender="surname">Smith</emph></persname><emph altrender="rank"><O',
+]
+
+
+if __name__ == "__main__":
+    problems = check_conformance(samples)
+    for source, soup_output, fast_output in problems:
+        print(f"MISMATCH\n  {source}\n  soup: {soup_output}\n  fast: {fast_output}")
+    print(f"{len(samples) - len(problems)} of {len(samples)} samples match")
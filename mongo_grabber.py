@@ -1,15 +1,27 @@
 import requests
 import json
+import ijson
 from slugify import slugify
-from copy import deepcopy
 import logging
-from nlp import flatten_to_string, string_to_entities
+import time
+from nlp import flatten_fields, analyse_text, record_nlp_time, unmatched_source_keys
 from iteration_utilities import grouper
-from es_docs_mongo import make_canonical, es_iterator
 from chancery import parse_description
-from bs4 import BeautifulSoup
+from html_text import strip_html
+from medal_card_parser import extract_medal_card_details_batch
+from name_keys import add_name_keys
 from elasticsearch import Elasticsearch
 import certifi
+from collections import Counter
+from functools import lru_cache
+from settings import (
+    kentigern_url,
+    kentigern_batch_size,
+    kentigern_store_mode,
+    medal_card_lookahead,
+    medal_card_gap_batches,
+)
+import kentigern_store
 
 logger = logging.getLogger("waitress")
 logger.setLevel(logging.DEBUG)
@@ -18,8 +30,75 @@ logger.setLevel(logging.DEBUG)
 with open("staticfiles/mongo_mappings.json") as f:
     mongo_map = json.load(f)
 
+# Kentigern records covering the fields that are flattened for the NLP, for flatten_keys_test
+kentigern_sample_file = "staticfiles/kentigern_sample.json"
 
-def get_mongo(obj_list, spacy_nlp=None, medal_card=False):
+# Reuse connections to Kentigern. Worker processes should replace this with their own session.
+kentigern_session = requests.Session()
+
+# Running totals of ids sent to Kentigern, records returned, and records that were missing from a response
+kentigern_stats = Counter()
+
+
+def post_kentigern(batch, store=False):
+    """
+    POST a single batch of ids to Kentigern, and yield the records one at a time as the response is
+    decoded, rather than loading the whole response into memory first.
+
+    :param batch: list of {"id": ..., "level": ...} dicts
+    :param store: if True, write the records (and nulls for ids with no record) to the local store
+    :return: generator of Kentigern records
+    """
+    kentigern_stats["requested"] += len(batch)
+    levels = {i["id"]: i["level"] for i in batch}
+    seen = set()
+    with kentigern_session.post(url=kentigern_url, json=batch, stream=True) as mongo_data:
+        if mongo_data.status_code != requests.codes.ok:
+            kentigern_stats["failed_requests"] += 1
+            logger.error(f"Kentigern returned {mongo_data.status_code} for a batch of {len(batch)}")
+            return
+        mongo_data.raw.decode_content = True
+        try:
+            for record in ijson.items(mongo_data.raw, "item", use_float=True):
+                kentigern_stats["returned"] += 1
+                if store:
+                    kentigern_store.write_record(record["id"], levels.get(record["id"]), record)
+                    seen.add(record["id"])
+                yield record
+        except (ijson.JSONError, requests.exceptions.RequestException) as e:
+            kentigern_stats["failed_requests"] += 1
+            logger.error(f"Failed reading the Kentigern response for a batch of {len(batch)}: {e}")
+            return
+    if store:
+        kentigern_store.save_missing(batch, seen)
+
+
+def iter_mongo(ids, batch_size=kentigern_batch_size, store_mode=kentigern_store_mode):
+    """
+    Yield the Kentigern records for a list of ids, POSTing them in batches of batch_size.
+
+    Depending on store_mode, records are read from and/or written to the local Kentigern store
+    (see kentigern_store.py).
+
+    :param ids: list of {"id": ..., "level": ...} dicts
+    :param batch_size: maximum number of ids to send in one request
+    :param store_mode: one of kentigern_store.MODES
+    :return: generator of Kentigern records
+    """
+    if store_mode in ("replay", "read-through"):
+        ids, stored = kentigern_store.lookup(ids)
+        yield from stored
+        if store_mode == "replay":
+            return
+    for start in range(0, len(ids), batch_size):
+        yield from post_kentigern(
+            ids[start : start + batch_size], store=store_mode in ("record", "read-through")
+        )
+
+
+def get_mongo(
+    obj_list, spacy_nlp=None, medal_card=False, store_mode=kentigern_store_mode, fetch=iter_mongo
+):
     """
     decorate the object from the initial ILDB harvest and make_canonical process with Mongo data.
 
@@ -28,133 +107,214 @@ def get_mongo(obj_list, spacy_nlp=None, medal_card=False):
     :param obj_list:
     :param spacy_nlp: optional
     :param medal_card: don't create person entities for medal cards.
+    :param store_mode: how to use the local Kentigern store, see kentigern_store.py
+    :param fetch: function that yields the Kentigern records for a list of ids, iter_mongo by default
     :return:
     """
     ids = [{"id": obj["id"], "level": obj["level"]} for obj in obj_list]
+    wanted = {obj["id"] for obj in obj_list}
     # Run a request to the Mongo service (kentigern) to get the Mongo data for that list of ids.
-    mongo_data = requests.post(
-        url="https://alpha.nationalarchives.gov.uk/kentigern/gather", json=ids
-    )
-    if mongo_data.status_code == requests.codes.ok:
-        mongo = mongo_data.json()
-    else:
-        mongo = None
-    # if we have data, filter it to just things that have data and
-    # which match an id in the list from ILDB
-    if mongo:
-        mongo_filtered = [
-            list(filter(lambda mongo_o: mongo_o["id"] == o["id"], mongo))[0] for o in obj_list
-        ]
-    else:
-        mongo_filtered = None
-    # Map the mongo data to have the right field names rather than the abbreviated/cryptic form
-    # used in Mongo
-    if mongo_filtered:
-        mongo_ = map_mongo(mong_data=mongo_filtered)
-    else:
-        mongo_ = None
-    # Create a copy of the list (do we need to do this?) and decorate with reformatted mongo data.
+    # Map each record to have the right field names rather than the abbreviated/cryptic form used in
+    # Mongo as it is decoded, keeping just those which match an id in the list from ILDB
+    mongo_ = {}
+    for mongo_o in fetch(ids, store_mode=store_mode):
+        if mongo_o["id"] in wanted:
+            mongo_[mongo_o["id"]] = mongo_recurse(mongo_o["iadata"], mongo_table)
+    missing = len(wanted) - len(mongo_)
+    if missing:
+        kentigern_stats["missing"] += missing
+        logger.debug(f"Kentigern returned no data for {missing} of {len(wanted)} records")
+    # Decorate the objects in place with the reformatted mongo data. make_canonical has already built
+    # these dicts for this chunk, so nothing else holds a reference to them and there's no need to copy.
     if mongo_:
-        new_obj_list = deepcopy(obj_list)
-        for obj in new_obj_list:
-            obj["mongo"] = mongo_.get(obj["id"])
-            if obj["mongo"]:
-                obj["iaid"] = obj["mongo"]["iaid"]
-            if spacy_nlp:
-                e = string_to_entities(
-                    input_string=flatten_to_string(obj), nlp=spacy_nlp, medal_card=medal_card
-                )
-                if e:
-                    obj.update(e)
-                if obj["id"].startswith("C:"):
-                    if obj.get("mongo"):
-                        scope = obj["mongo"].get("scope_and_content")
-                        if scope:
-                            obj_d = scope.get("description")
-                            if obj_d:
-                                if (
-                                    ("Short title" in obj_d)
-                                    or ("Plaintiffs" in obj_d)
-                                    or ("Defendants" in obj_d)
-                                ):
-                                    obj["chancery"] = parse_description(
-                                        description=obj_d, spacy_nlp=spacy_nlp
-                                    )
-                                    print(json.dumps(obj["chancery"], indent=2))
-        return new_obj_list
+        return enrich_records(obj_list, mongo_, spacy_nlp=spacy_nlp, medal_card=medal_card)
     else:
         return obj_list
 
 
-def mongo_recurse(mongo_dict, mappings):
-    new_dict = {}
+def enrich_records(obj_list, mongo_, spacy_nlp=None, medal_card=False):
+    """
+    Add the mapped Mongo data, and entities if a spacy model is passed in, to each object in the list.
+
+    The objects are annotated in place and the same list is returned.
+
+    :param obj_list: list of objects from make_canonical
+    :param mongo_: dict of mapped Mongo data, by id, from map_mongo
+    :param spacy_nlp: optional
+    :param medal_card: don't create person entities for medal cards.
+    :return:
+    """
+    for obj in obj_list:
+        obj["mongo"] = mongo_.get(obj["id"])
+        if obj["mongo"]:
+            obj["iaid"] = obj["mongo"]["iaid"]
+    for obj in obj_list:
+        if spacy_nlp:
+            started = time.perf_counter()
+            # Each field is stripped of its markup once, here, and the Chancery parse reuses the description
+            fields = {k: strip_html(v) for k, v in flatten_fields(obj).items()}
+            analysis = analyse_text(
+                input_string=" ".join(v for v in fields.values() if v),
+                nlp=spacy_nlp,
+                medal_card=medal_card,
+                plaintext=True,
+                level=obj.get("level"),
+                lettercode=obj.get("letter_code"),
+            )
+            if analysis:
+                if analysis[2]:
+                    obj.update(analysis[2])
+                record_nlp_time(
+                    obj["id"],
+                    time.perf_counter() - started,
+                    len(analysis[0]),
+                    (analysis[2] or {}).get("nlp_limited"),
+                )
+            if obj["id"].startswith("C:"):
+                if obj.get("mongo"):
+                    scope = obj["mongo"].get("scope_and_content")
+                    if scope:
+                        obj_d = scope.get("description")
+                        if obj_d:
+                            if (
+                                ("Short title" in obj_d)
+                                or ("Plaintiffs" in obj_d)
+                                or ("Defendants" in obj_d)
+                            ):
+                                # Take the parties from the main parse, rather than running spacy again
+                                obj["chancery"] = parse_description(
+                                    description=obj_d,
+                                    spacy_nlp=spacy_nlp,
+                                    plaintext=fields.get("mongo.scope_and_content.description"),
+                                    main_text=analysis[0] if analysis else None,
+                                    main_spans=analysis[1] if analysis else None,
+                                )
+                                print(json.dumps(obj["chancery"], indent=2))
+    return obj_list
+
+
+@lru_cache(maxsize=None)
+def slug_key(key):
+    """
+    Turn a Mongo key, or a label from the mappings, into the field name used in the output.
+
+    Memoised, as slugify is expensive and the same few hundred keys occur in every record.
+
+    :param key:
+    :return:
+    """
+    return slugify(key).replace("-", "_")
+
+
+def compile_mappings(mappings):
+    """
+    Compile the mongo_mappings.json structure into a translation table of
+
+        {mongo_key: (output_key, nested_table)}
+
+    so that the output keys are slugified once, rather than for every key of every record.
+
+    :param mappings: dict loaded from staticfiles/mongo_mappings.json, or the "nested" part of it
+    :return: dict
+    """
+    table = {}
+    if mappings:
+        for k, v in mappings.items():
+            if isinstance(v, dict):
+                table[k] = (slug_key(v["label"]), compile_mappings(v.get("nested")) or None)
+            elif v:
+                table[k] = (slug_key(v), None)
+    return table
+
+
+mongo_table = compile_mappings(mongo_map)
+unmapped_keys = set()
+
+
+def mongo_recurse(mongo_dict, table=None):
+    """
+    Translate the abbreviated Mongo keys in a record into human readable keys, using a compiled
+    translation table.
+
+    Where there is no table for this part of the record, the top level table is used, and
+    keys that aren't in the table are slugified as they are.
+
+    :param mongo_dict: dict, list or value from the iadata for a record
+    :param table: compiled translation table from compile_mappings
+    :return:
+    """
     if isinstance(mongo_dict, dict):
+        lookup = table or mongo_table
+        new_dict = {}
         for k, v in mongo_dict.items():
-            if mappings:
-                if mappings.get(k):
-                    try:
-                        new_key = slugify(mappings[k]["label"]).replace("-", "_")
-                    except TypeError:
-                        new_key = slugify(mappings[k]).replace("-", "_")
-                else:
-                    new_key = slugify(k).replace("-", "_")
+            entry = lookup.get(k)
+            if entry:
+                new_key, nested = entry
             else:
-                logging.error(
-                    "This is a no mappings error when trying to identify the mapped key"
-                    " for a dict key/value pairß."
-                )
-                try:
-                    logging.error("I am trying to get the key from master map")
-                    new_key = slugify(mongo_map[k]["label"]).replace("-", "_")
-                except:
-                    logging.error("I FAILED to get key from master map")
-                    new_key = slugify(k).replace("-", "_")
-                logging.error(f"Existing key: {k}")
-                logging.error(f"Key: {new_key}")
-                logging.error(f"Value list: {v}")
-                logging.error(f"Mongo dict: {mongo_dict}")
+                new_key, nested = slug_key(k), None
+                if k not in unmapped_keys:
+                    unmapped_keys.add(k)
+                    logger.debug(f"No mapping for Mongo key: {k}")
             if isinstance(v, dict):
-                new_dict[new_key] = mongo_recurse(v, mappings[k]["nested"])
+                new_dict[new_key] = mongo_recurse(v, nested)
             elif isinstance(v, list):
-                try:
-                    # hack catch for when the val is just a list of values
-                    if all([isinstance(val, (str, int)) for val in v]):
-                        new_dict[new_key] = v
-                    else:
-                        new_dict[new_key] = [mongo_recurse(x, mappings[k]["nested"]) for x in v]
-                except TypeError:
-                    logging.error("This is a type error when parsing a list of values.")
-                    logging.error(f"Existing key: {k}")
-                    logging.error(f"Key: {new_key}")
-                    logging.error(f"Value list: {v}")
-                    logging.error(f"Mappings: {mappings[k]}")
-                    logging.error(f"Mongo dict: {mongo_dict}")
+                # hack catch for when the val is just a list of values
+                if all([isinstance(val, (str, int)) for val in v]):
+                    new_dict[new_key] = v
+                else:
+                    new_dict[new_key] = [mongo_recurse(x, nested) for x in v]
             else:
                 new_dict[new_key] = v
+        return new_dict
     elif isinstance(mongo_dict, list):
-        return [mongo_recurse(x, mappings=mappings) for x in mongo_dict]
+        return [mongo_recurse(x, table) for x in mongo_dict]
     else:
         return mongo_dict
-    return new_dict
 
 
 def map_mongo_test():
-    with open("staticfiles/mongo_mappings.json") as f:
-        mongo_map = json.load(f)
     mong = requests.get("https://alpha.nationalarchives.gov.uk/kentigern/test")
     if mong.status_code == requests.codes.ok:
         mong_data = json.loads(mong.content)
     else:
         mong_data = None
     if mong_data:
-        return {x["id"]: mongo_recurse(x["iadata"], mappings=mongo_map) for x in mong_data}
+        return map_mongo(mong_data=mong_data)
     else:
         return []
 
 
+def flatten_keys_test(sample_file=kentigern_sample_file):
+    """
+    Check that every source key used by flatten_to_string has a value in at least one of the bundled sample
+    Kentigern records, which cover the fields that are flattened, so a misspelt path or a mapping change
+    shows up without the live Kentigern test endpoint
+
+    :param sample_file: JSON list of Kentigern records, each with the id, level and title from ILDB
+    :return: number of sample records checked
+    :raises ValueError: if the sample is empty, or a source key has no value in it
+    """
+    with open(sample_file, "r") as f:
+        sample = json.load(f)
+    if not sample:
+        raise ValueError(f"No sample Kentigern records in {sample_file}")
+    mapped = map_mongo(mong_data=sample)
+    documents = [{"title": record.get("title"), "mongo": mapped[record["id"]]} for record in sample]
+    unmatched = unmatched_source_keys(documents)
+    if unmatched:
+        raise ValueError(f"No value in {sample_file} for the source keys: {', '.join(unmatched)}")
+    return len(documents)
+
+
 def map_mongo(mong_data=None):
+    """
+    Map a batch of Kentigern records to a dict of {id: translated record}
+
+    :param mong_data: list of Kentigern records
+    :return:
+    """
     if mong_data:
-        return {x["id"]: mongo_recurse(x["iadata"], mappings=mongo_map) for x in mong_data}
+        return {x["id"]: mongo_recurse(x["iadata"], mongo_table) for x in mong_data}
     else:
         print("No data received from Mongo")
         return []
@@ -162,6 +322,7 @@ def map_mongo(mong_data=None):
 
 def reverse_mong(letter_code, division, series, piece, level="Item", max_id_range=260000):
     """
+    Lazily generate batches of 200 candidate items for a piece, for ids that only exist in Mongo.
 
     :param letter_code
     :param division
@@ -172,7 +333,7 @@ def reverse_mong(letter_code, division, series, piece, level="Item", max_id_rang
     :return:
     """
     base_id = f"{letter_code}:~{division}:{series}:{piece}"
-    items = [
+    items = (
         {
             "id": base_id + ":" + str(i),
             "level": level,
@@ -185,89 +346,191 @@ def reverse_mong(letter_code, division, series, piece, level="Item", max_id_rang
             "piece_ref": str(piece),
         }
         for i in range(1, max_id_range)
-    ]
+    )
     for group in grouper(items, 200, fillvalue=None):
         yield [g for g in group if g is not None]
 
 
-def iterate_reverse_mong(rev, nlp_proc=None, piece=None):
+def probe_items(
+    base_id, start, lookahead, level="Item", store_mode=kentigern_store_mode, fetch=iter_mongo
+):
+    """
+    Check whether Kentigern has a record for any of the items start to start + lookahead - 1
+
+    :param base_id: id of the piece, e.g. WO:~16:372:1
+    :param start: first item number to check
+    :param lookahead: number of items to check
+    :param level:
+    :param store_mode: how to use the local Kentigern store, see kentigern_store.py
+    :param fetch: function that yields the Kentigern records for a list of ids
+    :return: boolean
+    """
+    ids = [{"id": f"{base_id}:{i}", "level": level} for i in range(start, start + lookahead)]
+    for _ in fetch(ids, store_mode=store_mode):
+        return True
+    return False
+
+
+def discover_extent(
+    letter_code,
+    division,
+    series,
+    piece,
+    level="Item",
+    max_id_range=260000,
+    lookahead=medal_card_lookahead,
+    store_mode=kentigern_store_mode,
+    fetch=iter_mongo,
+):
+    """
+    Find the last item number for a piece by probing Kentigern, rather than walking every possible id.
+
+    1) double the item number until a probe finds nothing, to bracket the end of the range
+    2) binary search between the last probe that found something and the first that didn't
+
+    Each probe checks a window of lookahead items, so gaps in the numbering shorter than that don't end
+    the range early. A longer gap can, so the result is only a lower bound on the last item: items up to it
+    exist, but there may be more after a gap, see iterate_reverse_mong.
+
+    :param letter_code:
+    :param division:
+    :param series:
+    :param piece:
+    :param level:
+    :param max_id_range:
+    :param lookahead: number of items checked by each probe
+    :param store_mode: how to use the local Kentigern store, see kentigern_store.py
+    :param fetch: function that yields the Kentigern records for a list of ids
+    :return: last item number found, or 0 if no items were found
+    """
+    base_id = f"{letter_code}:~{division}:{series}:{piece}"
+
+    def probe(start):
+        return probe_items(
+            base_id, start, lookahead, level=level, store_mode=store_mode, fetch=fetch
+        )
+
+    if not probe(1):
+        return 0
+    found, not_found = 1, None
+    while found * 2 < max_id_range:
+        if probe(found * 2):
+            found *= 2
+        else:
+            not_found = found * 2
+            break
+    if not_found is None:
+        not_found = max_id_range
+    while not_found - found > 1:
+        mid = (found + not_found) // 2
+        if probe(mid):
+            found = mid
+        else:
+            not_found = mid
+    extent = min(found + lookahead - 1, max_id_range - 1)
+    logger.info(f"Discovered extent of {base_id}: up to item {extent}")
+    return extent
+
+
+def iterate_reverse_mong(
+    rev,
+    nlp_proc=None,
+    piece=None,
+    store_mode=kentigern_store_mode,
+    max_empty_batches=medal_card_gap_batches,
+    extent=None,
+    fetch=iter_mongo,
+):
     """
     Iterate a list of ids that have been provided by the reverse_mong function (that just generates some IDs)
     fetching the records from mongo via Kentigern and decorating with NLP.
 
+    Stops once max_empty_batches batches in a row past the extent have had no data, so that a gap in the
+    numbering doesn't lose the items after it.
+
     :param rev:
     :param nlp_proc: optional spacy NLP model
     :param piece:
+    :param store_mode: how to use the local Kentigern store, see kentigern_store.py
+    :param max_empty_batches: number of consecutive empty batches after which to stop
+    :param extent: optional lower bound on the last item number, from discover_extent. Empty batches up to it
+    don't count towards max_empty_batches.
+    :param fetch: function that yields the Kentigern records for a list of ids
     :return:
     """
     count = 0
+    empty_batches = 0
     for item_list in rev:
-        mongos = [
-            extract_medal_card_details(m)
-            for m in get_mongo(obj_list=item_list, spacy_nlp=nlp_proc, medal_card=True)
-            if m.get("mongo")
-        ]
+        within_extent = extent is not None and int(item_list[-1]["item_ref"]) <= extent
+        mongos = add_name_keys(
+            extract_medal_card_details_batch(
+                [
+                    m
+                    for m in get_mongo(
+                        obj_list=item_list,
+                        spacy_nlp=nlp_proc,
+                        medal_card=True,
+                        store_mode=store_mode,
+                        fetch=fetch,
+                    )
+                    if m.get("mongo")
+                ]
+            )
+        )
         if mongos:
-            count += 1
-            print(f"Piece {piece} Records: {count * 200}")
+            empty_batches = 0
+            count += len(mongos)
+            print(f"Piece {piece} Records: {count}")
             yield mongos
-        else:
-            break
+        elif not within_extent:
+            empty_batches += 1
+            if empty_batches >= max_empty_batches:
+                break
 
 
 def medal_cards(spacy_nlp, piece):
+    # Imported here, as es_docs imports this module
+    from es_docs import make_canonical
+
+    extent = discover_extent(letter_code="WO", division=16, series=372, piece=piece, level="Item")
     for x in iterate_reverse_mong(
         reverse_mong(letter_code="WO", division=16, series=372, piece=piece, level="Item"),
         nlp_proc=spacy_nlp,
         piece=piece,
+        extent=extent,
     ):
         yield [make_canonical(c) for c in x]
 
 
-def extract_medal_card_details(mongo_object):
+def medal_card_gap_test(present=(range(1, 121), range(400, 900))):
     """
+    Check that a gap in the item numbering longer than the discover_extent lookahead doesn't lose the items
+    after it, against a fake Kentigern that only has the items in present
 
-    :param mongo_object:
-    :return:
+    :param present: ranges of item numbers that have records
+    :return: (records harvested, records expected)
     """
-    html_string = mongo_object["mongo"]["scope_and_content"]["description"]
-    try:
-        soup = BeautifulSoup(html_string, "html.parser")
-        details = dict(person={}, details=[])
-        for person in soup.find_all("persname"):
-            try:
-                details["person"]["forenames"] = person.find(
-                    "emph", {"altrender": "forenames"}
-                ).contents[0]
-            except AttributeError or IndexError:
-                details["person"]["forenames"] = None
-            try:
-                details["person"]["surname"] = person.find(
-                    "emph", {"altrender": "surname"}
-                ).contents[0]
-            except AttributeError or IndexError:
-                details["person"]["surname"] = None
-            details["person"][
-                "combined_name"
-            ] = f'{details["person"]["forenames"]} {details["person"]["surname"]}'
-        for detail in soup.find_all("emph", {"altrender": "medal"}):
-            try:
-                corps = detail.find("corpname").contents[0]
-            except AttributeError or IndexError:
-                corps = None
-            try:
-                regiment_no = detail.find("emph", {"altrender": "regno"}).contents[0]
-            except AttributeError or IndexError:
-                regiment_no = None
-            try:
-                rank = detail.find("emph", {"altrender": "rank"}).contents[0]
-            except AttributeError or IndexError:
-                rank = None
-            details["details"].append({"corps": corps, "regiment_no": regiment_no, "rank": rank})
-        mongo_object["medal_card"] = details
-        return mongo_object
-    except:
-        return mongo_object
+    base_id = "WO:~16:372:1"
+    wanted = {f"{base_id}:{i}" for r in present for i in r}
+
+    def fake_iter_mongo(ids, store_mode=None, **kwargs):
+        for i in ids:
+            if i["id"] in wanted:
+                yield {"id": i["id"], "iadata": {"IAID": f"C{i['id'].rsplit(':', 1)[1]}"}}
+
+    extent = discover_extent(
+        letter_code="WO", division=16, series=372, piece=1, fetch=fake_iter_mongo
+    )
+    harvested = sum(
+        len(batch)
+        for batch in iterate_reverse_mong(
+            reverse_mong(letter_code="WO", division=16, series=372, piece=1),
+            extent=extent,
+            fetch=fake_iter_mongo,
+        )
+    )
+    assert harvested == len(wanted), f"Harvested {harvested} of {len(wanted)} records"
+    return harvested, len(wanted)
 
 
 if __name__ == "__main__":
@@ -290,6 +553,8 @@ if __name__ == "__main__":
         ]
     )
     # ======= Uncomment me to run the medal cards. =========
+    # from es_docs import es_iterator
+    #
     # for piece_ in range(1, 30):
     #     print(f"Working on {piece_} of 30")
     #     es.indices.put_settings(index=es_index, body=es_index_settings)
@@ -0,0 +1,94 @@
+"""
+Normalised and phonetic keys for personal names, computed at ingest so that name searches can be exact term
+queries against keyword fields rather than fuzzy queries.
+
+For "O'Brien", "Patrick J":
+
+    {
+        "surname": "obrien",
+        "forenames": "patrick j",
+        "initials": "pj",
+        "first_initial_surname": "p obrien",
+        "surname_soundex": "O165",
+        "surname_metaphone": "OBRN",
+        "surname_nysiis": "OBRAN",
+        "forename_soundex": ["P362"],
+    }
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+import jellyfish
+
+NON_LETTERS = re.compile(r"[^a-z ]+")
+SPACES = re.compile(r"\s+")
+
+
+def normalise_name(name):
+    """
+    Lowercase a name, strip accents and punctuation, and collapse the spaces
+
+    :param name:
+    :return: string, or None if nothing is left
+    """
+    if not name:
+        return
+    ascii_name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii")
+    # Drop apostrophes rather than splitting on them, so O'Brien becomes obrien
+    cleaned = NON_LETTERS.sub(" ", ascii_name.lower().replace("'", ""))
+    cleaned = SPACES.sub(" ", cleaned).strip()
+    return cleaned or None
+
+
+@lru_cache(maxsize=100000)
+def name_keys(forenames, surname):
+    """
+    Generate the keys for a name
+
+    :param forenames: forenames, or initials, as on the record
+    :param surname:
+    :return: dict of keys, or None if there is no usable surname or forename
+    """
+    surname_norm = normalise_name(surname)
+    forenames_norm = normalise_name(forenames)
+    if not surname_norm and not forenames_norm:
+        return
+    forename_parts = forenames_norm.split(" ") if forenames_norm else []
+    initials = "".join(part[0] for part in forename_parts) or None
+    keys = {
+        "surname": surname_norm,
+        "forenames": forenames_norm,
+        "initials": initials,
+        "first_initial_surname": None,
+        "surname_soundex": None,
+        "surname_metaphone": None,
+        "surname_nysiis": None,
+        # Single letters are initials, which don't have a useful phonetic code
+        "forename_soundex": [jellyfish.soundex(part) for part in forename_parts if len(part) > 1],
+    }
+    if surname_norm:
+        compact_surname = surname_norm.replace(" ", "")
+        keys["surname_soundex"] = jellyfish.soundex(compact_surname)
+        keys["surname_metaphone"] = jellyfish.metaphone(compact_surname)
+        keys["surname_nysiis"] = jellyfish.nysiis(compact_surname)
+        if initials:
+            keys["first_initial_surname"] = f"{initials[0]} {surname_norm}"
+    return keys
+
+
+def add_name_keys(mongo_objects):
+    """
+    Add the name keys to the person on each medal card, as medal_card.person.name_keys
+
+    :param mongo_objects: list of objects that have been through extract_medal_card_details
+    :return: the same list
+    """
+    for mongo_object in mongo_objects:
+        person = mongo_object.get("medal_card", {}).get("person")
+        if person:
+            keys = name_keys(person.get("forenames"), person.get("surname"))
+            if keys:
+                # Copy, as the dict from name_keys is shared through the cache
+                person["name_keys"] = dict(keys, forename_soundex=list(keys["forename_soundex"]))
+    return mongo_objects
@@ -1,21 +1,121 @@
 import spacy
-from geotext import GeoText
-import dateparser
-from flashtext import KeywordProcessor
 from collections import defaultdict
-import datetime
 from operator import itemgetter
 from personalnames import names
-from bs4 import BeautifulSoup
-from dictor import dictor
+import re
+import heapq
+import datetime
+import time
+from result_cache import ResultCache, hash_key
+from settings import (
+    entity_cache_size,
+    entity_cache_file,
+    name_cache_size,
+    name_cache_file,
+    nlp_max_chars,
+    nlp_window_chars,
+    nlp_oversize_mode,
+    nlp_time_budget,
+    nlp_report_size,
+    entity_output,
+    entity_fields,
+    archival_places,
+)
+from date_handling import date_entity, date_mentions
+from gazetteer import country_mentions
+from html_text import strip_html
+from nlp_tiers import choose_tier, record_tier
+
+SPACES = re.compile(r"\s+")
+
+# The settings that change the entities for a text, which are part of the entity cache key, so that a cache
+# file saved by a run with different settings isn't used
+entity_settings = "|".join(
+    str(setting)
+    for setting in (
+        entity_output,
+        ",".join(entity_fields),
+        archival_places,
+        nlp_max_chars,
+        nlp_window_chars,
+        nlp_oversize_mode,
+        nlp_time_budget,
+    )
+)
+
+# string_to_entities results, by a hash of the cleaned text and the options
+entity_cache = ResultCache(maxsize=entity_cache_size)
+if entity_cache_file:
+    entity_cache.load(entity_cache_file)
+
+# Sorted name variants, by name
+name_cache = ResultCache(maxsize=name_cache_size)
+if name_cache_file:
+    name_cache.load(name_cache_file)
+
+# The records that took longest to go through the NLP, as a heap of (seconds, id, characters, limit)
+slow_records = []
+
+
+# The fields that are flattened into the text for entity extraction, in order
+source_keys = [
+    "mongo.covering_dates",
+    "mongo.creators.corporate_body_name",
+    "mongo.note",
+    "mongo.physical_description_form",
+    "mongo.scope_and_content.description",
+    "mongo.related_material.description",
+    "mongo.separated_material.description",
+    "mongo.title",
+    "title",
+    "mongo.former_reference_dept",
+    "mongo.administrative_background",
+    "mongo.arrangement",
+    "mongo.custodial_history",
+]
+
+
+def get_path(obj, keys):
+    """
+    :param obj:
+    :param keys: the parts of a dotted path
+    :return: the value at the path, or None
+    """
+    for position, key in enumerate(keys):
+        if isinstance(obj, dict):
+            obj = obj.get(key)
+        elif isinstance(obj, (list, tuple)):
+            if key.isdigit():
+                obj = obj[int(key)] if int(key) < len(obj) else None
+            else:
+                # A list of records, e.g. the creators: the rest of the path in each, with the text joined
+                values = [get_path(item, keys[position:]) for item in obj]
+                return " ".join(v for v in values if v and isinstance(v, str)) or None
+        else:
+            return
+        if obj is None:
+            return
+    return obj
 
 
-def is_int(val):
-    try:
-        num = int(val)
-    except ValueError:
-        return False
-    return True
+def compile_getter(path):
+    """
+    Make a function that gets the value at a dotted path without parsing the path on every call. Numeric
+    parts index into lists, and other parts are looked up in each item of a list, e.g.
+    mongo.creators.corporate_body_name gives the names of all the creators, joined with spaces.
+
+    :param path: e.g. mongo.scope_and_content.description
+    :return: function taking the object and returning the value, or None
+    """
+    keys = tuple(path.split("."))
+
+    def getter(obj):
+        return get_path(obj, keys)
+
+    return getter
+
+
+source_getters = [compile_getter(k) for k in source_keys]
 
 
 def flatten_to_string(input_obj):
@@ -26,24 +126,48 @@ def flatten_to_string(input_obj):
     :param input_obj:
     :return:
     """
-    source_keys = [
-        "mongo.covering_dates",
-        "mongo.creators.corporate_body_name",
-        "mongo.note",
-        "mono.physical_description_form",
-        "mongo.scope_and_content.description",
-        "mongo.related_material.description",
-        "mongo.separated_material.description",
-        "mongo.title",
-        "title",
-        "description",
-        "mongo.former_reference_dept",
-        "mongo.administrative_background",
-        "mongo.arrangement",
-        "mongo.custodial_history",
-    ]
-    flat = " ".join([x for x in [dictor(input_obj, k) for k in source_keys] if x])
-    return flat
+    return " ".join([x for x in [getter(input_obj) for getter in source_getters] if x])
+
+
+def flatten_batch(obj_list):
+    """
+    :param obj_list: list of documents post Mongo enrichment
+    :return: list of flattened strings, one for each document
+    """
+    getters = source_getters
+    return [" ".join([x for x in [getter(obj) for getter in getters] if x]) for obj in obj_list]
+
+
+def flatten_fields(input_obj):
+    """
+    The values that flatten_to_string joins, by source key, so that a caller can strip the markup from each
+    field once and keep the plaintext of a particular field, e.g. the Chancery description
+
+    :param input_obj: document post Mongo enrichment
+    :return: dict of the source keys that have a value, in the order of source_keys
+    """
+    fields = {}
+    for key, getter in zip(source_keys, source_getters):
+        value = getter(input_obj)
+        if value:
+            fields[key] = value
+    return fields
+
+
+def unmatched_source_keys(obj_list):
+    """
+    Check the source keys against a sample of documents, to catch paths that are misspelt or that the
+    Mongo mappings no longer produce.
+
+    :param obj_list: list of documents post Mongo enrichment
+    :return: list of the source keys that have no value in any of the documents
+    """
+    matched = set()
+    for obj in obj_list:
+        for key, getter in zip(source_keys, source_getters):
+            if key not in matched and getter(obj):
+                matched.add(key)
+    return [key for key in source_keys if key not in matched]
 
 
 def entity_list_to_dict(entity_list):
@@ -58,117 +182,319 @@ def entity_list_to_dict(entity_list):
     return lookup
 
 
-def string_to_entities(
+def analyse_text(
     input_string: str,
     nlp,
     ent_types=("DATE", "GPE", "ORG", "FAC", "LOC", "PERSON"),
     medal_card=False,
+    plaintext=False,
+    level=None,
+    lettercode=None,
 ):
     """
+    Run the entity extraction on a string, which may contain markup, keeping the spacy spans as well.
+
+    Results are cached by a hash of the text after the markup is stripped and the whitespace collapsed,
+    so boilerplate that repeats across many records only goes through the NLP once.
+
+    Text is run through spacy in windows of nlp_window_chars, until nlp_time_budget is used up, so no record
+    can hold up a chunk for longer than the budget and one window. Text longer than nlp_max_chars is flagged
+    with nlp_limited: windowed, or skipped altogether with nlp_oversize_mode "skip". A record cut short by the
+    time budget is flagged time_budget, and isn't cached, as where it stops depends on the machine.
+
+    If the level or lettercode is passed in, the tier rules in nlp_tiers.py decide whether the text is worth
+    running through spacy. Text in the skip tier gets no entities, and text in the cheap tier only gets the
+    gazetteer places and the dates found by date_mentions.
 
     :param input_string:
     :param nlp: spacy model
     :param ent_types: filter to just these entity types
     :param medal_card: if True, ignore persons.
-    :return:
+    :param plaintext: if True, the string has already had the markup removed
+    :param level: level of the record, for the tier rules
+    :param lettercode: lettercode of the record, for the tier rules
+    :return: (text, spans, entities), where the spans are (text, label, start, end) offsets into the text,
+    and entities is None for the skip tier; or None if there is no text
     """
     if input_string:
-        soup = BeautifulSoup(input_string, features="html.parser")
-        text = soup.get_text()
+        started = time.perf_counter()
+        text = input_string if plaintext else strip_html(input_string)
+        text = SPACES.sub(" ", text).strip()
         if text and nlp:
-            doc = nlp(text)
-            places = GeoText(text)
-            geo_ents = []
-            date_ents = []
-            name_ents = []
-            ents = []
-            if any(i in ent_types for i in ["GPE", "FAC", "LOC"]):
-                for c in places.cities:
-                    geo_ents.append({"text": c, "label": "GPE"})
-                for c in places.country_mentions:
-                    geo_ents.append({"text": c, "label": "GPE"})
-                    ents.append({"text": c, "label": "GPE"})
-            # Use flash text to get the bounds for the non-Spacy entities
-            # Can also be used later to decorate with, e.g. the orgnames from Mongo
-            for ent in doc.ents:
-                if ent.label_ in ent_types:
-                    if ent.label_ == "DATE":
-                        # Little bit of a hack to handle date ranges
-                        if "-" in ent.text:  # We something that looks like a date range
-                            split_ents = [x.strip() for x in ent.text.split("-")]
-                        else:  # Or we don't
-                            split_ents = [ent.text]
-                        for entity in split_ents:
-                            if entity:
-                                try:
-                                    if is_int(
-                                        entity
-                                    ):  # Handle cases where this is a year only, to avoid insertion of today
-                                        d = dateparser.parse(entity).year
-                                    else:
-                                        try:
-                                            if str(entity[0]) == "-":
-                                                entity = str(entity[1:])
-                                            d = dateparser.parse(entity)
-                                        except ValueError or IndexError:
-                                            d = None
-                                except ValueError or IndexError:
-                                    d = None
-                                if d:
-                                    try:
-                                        end_year = dateparser.parse(
-                                            entity,
-                                            settings={
-                                                "RELATIVE_BASE": datetime.datetime(2020, 12, 31)
-                                            },
-                                        )
-                                    except ValueError:
-                                        end_year = None
-                                    try:
-                                        start_year = dateparser.parse(
-                                            entity,
-                                            settings={
-                                                "RELATIVE_BASE": datetime.datetime(2020, 1, 1)
-                                            },
-                                        )
-                                    except ValueError:
-                                        start_year = None
-                                    if start_year and end_year:
-                                        date_ents.append(
-                                            {
-                                                "text": entity,
-                                                "date": f"{d}",
-                                                "label": "DATE",
-                                                "year_start": start_year,
-                                                "year_end": end_year,
-                                            }
-                                        )
-                                    else:
-                                        date_ents.append({"text": entity, "label": "DATE"})
-                                else:  # Date parser couldn't identify the date, but we know it is one.
-                                    date_ents.append({"text": entity, "label": "DATE"})
-                    elif ent.label_ == "PERSON":
-                        try:
-                            variants = names.name_initials(
-                                name=ent.text,
-                                name_formats=["firstnamelastname", "lastnamefirstname"],
-                            )
-                            sorted_v = sorted(variants)
-                        except IndexError or KeyError or ValueError:
-                            sorted_v = None
-                        name_ents.append(
-                            {"text": ent.text, "label": ent.label_, "variants": sorted_v}
-                        )
-                    else:  # Just iterate the entities
-                        matches = [e["text"] for e in ents + date_ents + name_ents]
-                        if ent.text not in matches:
-                            ents.append({"text": ent.text, "label": ent.label_})
-            if medal_card:
-                master_list = date_ents
-            else:
-                master_list = ents + name_ents + date_ents
-            return {
-                "entity_list": master_list,
-                "entities_by_type": entity_list_to_dict(master_list),
-            }
+            tier = "full"
+            if level or lettercode:
+                tier = choose_tier(text, level=level, lettercode=lettercode)
+            if tier == "skip":
+                record_tier(tier, time.perf_counter() - started)
+                return text, [], None
+            meta = getattr(nlp, "meta", {})
+            key = hash_key(
+                text,
+                ",".join(ent_types),
+                medal_card,
+                meta.get("name"),
+                meta.get("version"),
+                tier,
+                entity_settings,
+            )
+            found, result = entity_cache.get(key)
+            if not found:
+                limit = None
+                if tier == "cheap":
+                    spans = [(t, "DATE", start, end) for t, start, end in date_mentions(text)]
+                elif len(text) > nlp_max_chars and nlp_oversize_mode == "skip":
+                    spans, limit = [], "skipped"
+                else:
+                    spans, finished = windowed_spans(text, nlp)
+                    if not finished:
+                        limit = "time_budget"
+                    elif len(text) > nlp_max_chars:
+                        limit = "windowed"
+                entities = spans_to_entities(
+                    spans,
+                    text,
+                    ent_types=ent_types,
+                    medal_card=medal_card,
+                    compact=entity_output == "compact",
+                )
+                if limit:
+                    # Flag the record, so that it can be found and re-run
+                    entities["nlp_limited"] = limit
+                result = {"spans": spans, "entities": entities}
+                if limit != "time_budget":
+                    entity_cache.put(key, result)
+            record_tier(tier, time.perf_counter() - started)
+            return text, result["spans"], result["entities"]
     return
+
+
+def string_to_entities(
+    input_string: str,
+    nlp,
+    ent_types=("DATE", "GPE", "ORG", "FAC", "LOC", "PERSON"),
+    medal_card=False,
+    plaintext=False,
+):
+    """
+    Extract the entities from a string, which may contain markup.
+
+    :param input_string:
+    :param nlp: spacy model
+    :param ent_types: filter to just these entity types
+    :param medal_card: if True, ignore persons.
+    :param plaintext: if True, the string has already had the markup removed
+    :return:
+    """
+    analysis = analyse_text(
+        input_string, nlp, ent_types=ent_types, medal_card=medal_card, plaintext=plaintext
+    )
+    if analysis:
+        return analysis[2]
+    return
+
+
+def entity_spans(text: str, nlp):
+    """
+    Run spacy over plain text
+
+    :param text:
+    :param nlp: spacy model
+    :return: list of (text, label, start, end) for the entities spacy finds
+    """
+    return [(ent.text, ent.label_, ent.start_char, ent.end_char) for ent in nlp(text).ents]
+
+
+def windowed_spans(text: str, nlp, window=nlp_window_chars, budget=nlp_time_budget):
+    """
+    Run spacy over a text in windows, so that no single call takes too long, stopping once the time
+    budget is used up. Text no longer than a window goes through spacy in one call.
+
+    :param text:
+    :param nlp: spacy model
+    :param window: most characters to pass to spacy at once
+    :param budget: seconds after which the rest of the text is left out
+    :return: (spans, False if the budget ran out before the end of the text)
+    """
+    spans = []
+    started = time.perf_counter()
+    start = 0
+    while start < len(text):
+        end = min(start + window, len(text))
+        if end < len(text):
+            # End the window at a sentence, or at least a word, so that entities aren't cut in half
+            cut = text.rfind(". ", start, end)
+            if cut <= start:
+                cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut + 1
+        for ent_text, label, ent_start, ent_end in entity_spans(text[start:end], nlp):
+            spans.append((ent_text, label, ent_start + start, ent_end + start))
+        start = end
+        if start < len(text) and time.perf_counter() - started > budget:
+            return spans, False
+    return spans, True
+
+
+def record_nlp_time(record_id, seconds, characters, limit=None, size=nlp_report_size):
+    """
+    Keep track of the slowest records
+
+    :param record_id:
+    :param seconds: time taken by the NLP
+    :param characters: length of the text
+    :param limit: the nlp_limited flag, if the record was limited
+    :param size: number of records to keep
+    :return:
+    """
+    entry = (seconds, record_id, characters, limit)
+    if len(slow_records) < size:
+        heapq.heappush(slow_records, entry)
+    elif seconds > slow_records[0][0]:
+        heapq.heapreplace(slow_records, entry)
+
+
+def slow_records_report(reset=True):
+    """
+    :param reset: start a new list afterwards, e.g. for the next lettercode
+    :return: list of lines describing the slowest records, slowest first
+    """
+    lines = [
+        f"NLP {seconds:.2f}s for {record_id} ({characters} characters{f', {limit}' if limit else ''})"
+        for seconds, record_id, characters, limit in sorted(slow_records, reverse=True)
+    ]
+    if reset:
+        slow_records.clear()
+    return lines
+
+
+def name_variants(name):
+    """
+    The forms of a name with initials, e.g. John Smith: J. Smith, John Smith, Smith, J., Smith, John
+
+    Memoised in name_cache, as the same names turn up thousands of times in a department.
+
+    :param name:
+    :return: sorted list of variants, or None if the name couldn't be parsed
+    """
+    found, variants = name_cache.get(name)
+    if not found:
+        try:
+            variants = sorted(
+                names.name_initials(
+                    name=name, name_formats=["firstnamelastname", "lastnamefirstname"]
+                )
+            )
+        except (IndexError, KeyError, ValueError):
+            variants = None
+        name_cache.put(name, variants)
+    return variants
+
+
+def name_variants_batch(name_list):
+    """
+    :param name_list: list of names, which can repeat
+    :return: dict of name to its sorted variants
+    """
+    return {name: name_variants(name) for name in set(name_list)}
+
+
+def spans_to_entities(
+    spans,
+    text: str,
+    ent_types=("DATE", "GPE", "ORG", "FAC", "LOC", "PERSON"),
+    medal_card=False,
+    compact=False,
+):
+    """
+    Turn spacy spans into the entity output: dates are split and normalised, people get name variants,
+    and places come from the gazetteer rather than spacy.
+
+    The default output has the entities twice, as entity_list and grouped by type in entities_by_type.
+    The compact output (settings.entity_output = "compact") is a single "entities" list, see compact_entity.
+
+    :param spans: list of (text, label, start, end), from entity_spans
+    :param text: the text the spans are from
+    :param ent_types: filter to just these entity types
+    :param medal_card: if True, ignore persons.
+    :param compact: if True, return the compact output
+    :return:
+    """
+    date_ents = []
+    name_ents = []
+    ents = []
+    if any(i in ent_types for i in ["GPE", "FAC", "LOC"]):
+        for c in country_mentions(text):
+            ents.append({"text": c, "label": "GPE"})
+    person_variants = {}
+    if "PERSON" in ent_types and not medal_card:
+        person_variants = name_variants_batch([span[0] for span in spans if span[1] == "PERSON"])
+    for ent_text, label, start, end in spans:
+        if label in ent_types:
+            if label == "DATE":
+                # Little bit of a hack to handle date ranges
+                if "-" in ent_text:  # We something that looks like a date range
+                    split_ents = [x.strip() for x in ent_text.split("-")]
+                else:  # Or we don't
+                    split_ents = [ent_text]
+                position = 0
+                for entity in split_ents:
+                    if entity:
+                        date_ent = date_entity(entity)
+                        if compact:
+                            position = ent_text.find(entity, position)
+                            date_ent["start"] = start + position
+                            date_ent["end"] = start + position + len(entity)
+                            position += len(entity)
+                        date_ents.append(date_ent)
+            elif label == "PERSON":
+                if not medal_card:  # Persons are left out for medal cards
+                    name_ent = {"text": ent_text, "label": label}
+                    if compact:
+                        name_ent.update(start=start, end=end)
+                    name_ent["variants"] = person_variants[ent_text]
+                    name_ents.append(name_ent)
+            else:  # Just iterate the entities
+                matches = [e["text"] for e in ents + date_ents + name_ents]
+                if ent_text not in matches:
+                    ent = {"text": ent_text, "label": label}
+                    if compact:
+                        ent.update(start=start, end=end)
+                    ents.append(ent)
+    if medal_card:
+        master_list = date_ents
+    else:
+        master_list = ents + name_ents + date_ents
+    if compact:
+        return {"entities": [compact_entity(entity) for entity in master_list]}
+    return {
+        "entity_list": master_list,
+        "entities_by_type": entity_list_to_dict(master_list),
+    }
+
+
+def compact_entity(entity, fields=entity_fields):
+    """
+    Reduce an entity to the fields that are stored, with the dates as ISO strings, so that the document is
+    smaller and serialises without the JSON encoder falling back to its slow path for datetimes.
+
+    e.g. {"text": "12 March 1845", "label": "DATE", "start": 31, "end": 44, "date": "1845-03-12",
+          "year_start": "1845-03-12", "year_end": "1845-03-12"}
+
+    Places from the gazetteer are country codes, and have no position.
+
+    :param entity: entity dict from spans_to_entities
+    :param fields: the fields to keep, settings.entity_fields
+    :return: dict
+    """
+    compact = {}
+    for field in fields:
+        value = entity.get(field)
+        if value is None:
+            continue
+        if isinstance(value, datetime.datetime):
+            value = value.date().isoformat()
+        elif field == "date" and len(value) > 10 and value[10] == " ":
+            # Drop the time from "1845-03-12 00:00:00"
+            value = value[:10]
+        compact[field] = value
+    return compact
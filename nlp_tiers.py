@@ -0,0 +1,93 @@
+"""
+Decide how much NLP a record's text is worth:
+
+    skip  - no entity extraction at all
+    cheap - places from the gazetteer and dates found with a regex, without spacy
+    full  - spacy, plus the gazetteer
+
+The rules are in config/nlp_tiers.json (settings.nlp_tiers_file). Each rule can force a tier, or set the
+thresholds on the length of the text:
+
+    {"tier": "full"}                                    always use this tier
+    {"skip_below_chars": 20, "full_from_chars": 150}    skip below 20 characters, full from 150, cheap between
+
+The default rule is overridden by the rule for the level, which is overridden by the rule for the lettercode.
+Text with no letters in it, e.g. just a reference, is always skipped.
+"""
+
+import json
+import re
+from collections import Counter
+from settings import nlp_tiers, nlp_tiers_file
+
+TIERS = ("skip", "cheap", "full")
+ALPHA = re.compile(r"[^\W\d_]")
+
+# Records and seconds spent in each tier, since the last tier_report
+tier_stats = Counter()
+tier_seconds = Counter()
+
+
+def load_rules(path=nlp_tiers_file):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+rules = load_rules() if nlp_tiers else None
+
+
+def rule_for(level=None, lettercode=None, tier_rules=None):
+    """
+    Merge the default, level and lettercode rules
+
+    :param level: e.g. Item
+    :param lettercode: e.g. WO
+    :param tier_rules: the rules, defaults to those loaded from nlp_tiers_file
+    :return: dict
+    """
+    tier_rules = tier_rules or rules or {}
+    rule = dict(tier_rules.get("default", {}))
+    rule.update(tier_rules.get("levels", {}).get(level, {}))
+    rule.update(tier_rules.get("lettercodes", {}).get(lettercode, {}))
+    return rule
+
+
+def choose_tier(text, level=None, lettercode=None, tier_rules=None):
+    """
+    :param text: plain text, with the whitespace collapsed
+    :param level:
+    :param lettercode:
+    :param tier_rules:
+    :return: skip, cheap or full
+    """
+    if not (tier_rules or rules):
+        return "full"
+    if not ALPHA.search(text):
+        return "skip"
+    rule = rule_for(level=level, lettercode=lettercode, tier_rules=tier_rules)
+    if rule.get("tier") in TIERS:
+        return rule["tier"]
+    if len(text) < rule.get("skip_below_chars", 0):
+        return "skip"
+    if len(text) < rule.get("full_from_chars", 0):
+        return "cheap"
+    return "full"
+
+
+def record_tier(tier, seconds):
+    tier_stats[tier] += 1
+    tier_seconds[tier] += seconds
+
+
+def tier_report(reset=True):
+    """
+    :param reset: start new counts afterwards, e.g. for the next lettercode
+    :return: string with the count and time for each tier
+    """
+    report = ", ".join(
+        f"{tier}: {tier_stats[tier]} records in {tier_seconds[tier]:.1f}s" for tier in TIERS
+    )
+    if reset:
+        tier_stats.clear()
+        tier_seconds.clear()
+    return report
@@ -0,0 +1,108 @@
+"""
+Bounded, least-recently-used cache for the results of expensive functions, e.g. entity extraction.
+
+Values are stored pickled, so every hit hands back a fresh copy that the caller can modify without
+changing the cached value, and so the cache can be saved to disk and loaded by a later run.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+from collections import Counter, OrderedDict
+from static_cache import write_atomic
+
+logger = logging.getLogger("")
+
+
+def hash_key(*parts):
+    """
+    Make a cache key from strings
+
+    :param parts: e.g. the cleaned text, and anything else that changes the result
+    :return: hex digest
+    """
+    return hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, maxsize=100000):
+        """
+        :param maxsize: most entries to hold; the least recently used are dropped beyond this
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.stats = Counter()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Look up a key
+
+        :param key:
+        :return: (found, value). value can be None, if None was the cached result.
+        """
+        try:
+            data = self.entries[key]
+        except KeyError:
+            self.stats["misses"] += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return True, pickle.loads(data)
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def report(self):
+        """
+        :return: string summarising the size and hit rate of the cache
+        """
+        return (
+            f"{len(self.entries)} entries, {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"({self.hit_rate():.1%}), {self.stats['evictions']} evictions"
+        )
+
+    def save(self, path):
+        """
+        Save the entries, least recently used first, so that the order survives a reload
+
+        :param path:
+        :return:
+        """
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(
+            path, pickle.dumps(list(self.entries.items()), protocol=pickle.HIGHEST_PROTOCOL)
+        )
+
+    def load(self, path):
+        """
+        Add the entries saved by an earlier run, if there are any
+
+        :param path:
+        :return: number of entries loaded
+        """
+        try:
+            with open(path, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return 0
+        for key, data in saved[-self.maxsize :] if self.maxsize > 0 else []:
+            self.entries[key] = data
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        logger.info(f"Loaded {len(saved)} cached results from {path}")
+        return len(saved)
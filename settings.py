@@ -14,3 +14,36 @@ es_port = os.environ.get("es_port", 443)
 es_resolver_index = os.environ.get("es_resolver_index", "path-resolver-mongo")
 flask_local = bool(strtobool(str(os.environ.get("flask_local", False))))
 es_update = bool(strtobool(str(os.environ.get("es_update", True))))
+staticdata_url = os.environ.get("staticdata_url", "https://alpha.nationalarchives.gov.uk/staticdata/")
+static_cache_dir = os.environ.get("static_cache_dir", "staticfiles/cache")
+static_cache_ttl = int(os.environ.get("static_cache_ttl", 86400))
+kentigern_url = os.environ.get("kentigern_url", "https://alpha.nationalarchives.gov.uk/kentigern/gather")
+kentigern_batch_size = int(os.environ.get("kentigern_batch_size", 1000))
+ildb_chunk_size = int(os.environ.get("ildb_chunk_size", 1000))
+kentigern_store_dir = os.environ.get("kentigern_store_dir", "kentigern_store")
+kentigern_store_mode = os.environ.get("kentigern_store_mode", "off")
+medal_card_lookahead = int(os.environ.get("medal_card_lookahead", 50))
+medal_card_gap_batches = int(os.environ.get("medal_card_gap_batches", 5))
+medal_card_checkpoint_dir = os.environ.get("medal_card_checkpoint_dir", "checkpoints/medal_cards")
+entity_cache_size = int(os.environ.get("entity_cache_size", 100000))
+entity_cache_file = os.environ.get("entity_cache_file", "")
+archival_places = bool(strtobool(str(os.environ.get("archival_places", False))))
+nlp_max_chars = int(os.environ.get("nlp_max_chars", 20000))
+nlp_window_chars = int(os.environ.get("nlp_window_chars", 5000))
+nlp_oversize_mode = os.environ.get("nlp_oversize_mode", "window")
+nlp_time_budget = float(os.environ.get("nlp_time_budget", 5.0))
+nlp_report_size = int(os.environ.get("nlp_report_size", 10))
+nlp_tiers = bool(strtobool(str(os.environ.get("nlp_tiers", True))))
+nlp_tiers_file = os.environ.get("nlp_tiers_file", "config/nlp_tiers.json")
+name_cache_size = int(os.environ.get("name_cache_size", 50000))
+name_cache_file = os.environ.get("name_cache_file", "")
+entity_output = os.environ.get("entity_output", "legacy")
+entity_fields = os.environ.get("entity_fields", "text,label,start,end,date,year_start,year_end,variants").split(",")
+bulk_serializer = os.environ.get("bulk_serializer", "orjson")
+es_compression = os.environ.get("es_compression", "gzip")
+es_compression_level = int(os.environ.get("es_compression_level", 6))
+ildb_pool_size = int(os.environ.get("ildb_pool_size", 2))
+bulk_in_flight = int(os.environ.get("bulk_in_flight", 4))
+bulk_chunk_size = int(os.environ.get("bulk_chunk_size", 200))
+bulk_flush_seconds = float(os.environ.get("bulk_flush_seconds", 5.0))
+bulk_queue_size = int(os.environ.get("bulk_queue_size", 2000))
@@ -0,0 +1,142 @@
+"""
+On-disk cache for the JSON assets published by the /staticdata/ service on Alpha.
+
+Each asset is stored in the cache directory as:
+
+    <asset>             the raw body, as served
+    <asset>.meta.json   the ETag / Last-Modified validators and the time it was last checked
+    <asset>.pickle      a binary snapshot of the parsed object, which is what callers are served
+
+Within the TTL the snapshot is returned without touching the network. After that the asset is
+revalidated with a conditional GET, so an unchanged asset costs a 304 rather than a download and a re-parse.
+"""
+
+import json
+import logging
+import os
+import pickle
+import time
+import requests
+from settings import staticdata_url, static_cache_dir, static_cache_ttl
+
+logger = logging.getLogger("waitress")
+
+
+def cache_paths(asset, cache_dir=static_cache_dir):
+    """
+    Return the body, metadata and snapshot paths for an asset
+
+    :param asset: asset name, e.g. eras.json
+    :param cache_dir: directory holding the cache
+    :return: tuple of paths
+    """
+    body_path = os.path.join(cache_dir, asset)
+    return body_path, f"{body_path}.meta.json", f"{body_path}.pickle"
+
+
+def write_atomic(path, data):
+    """
+    Write bytes to a temporary file and move it into place, so that concurrent workers never read a partial file.
+
+    :param path:
+    :param data: bytes
+    :return:
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(snapshot_path):
+    """
+    Load the parsed object from a binary snapshot
+
+    :param snapshot_path:
+    :return: the parsed object, or None if there is no usable snapshot
+    """
+    try:
+        with open(snapshot_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return
+
+
+def load_meta(meta_path):
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_fallback(fallback):
+    """
+    Load the copy of an asset that is stored in the repo
+
+    :param fallback: path to a local JSON file
+    :return: the parsed object, or None
+    """
+    if fallback and os.path.exists(fallback):
+        logger.info(f"Loading {fallback} from the repo")
+        with open(fallback, "r") as f:
+            return json.load(f)
+    return
+
+
+def get_static(asset, fallback=None, ttl=static_cache_ttl, cache_dir=static_cache_dir):
+    """
+    Return the parsed JSON for an asset from the /staticdata/ service, using the local cache where possible.
+
+    1) if the snapshot was checked within the TTL, return it
+    2) otherwise, revalidate with If-None-Match/If-Modified-Since and return the snapshot on a 304
+    3) on a 200, store the new body, validators and snapshot
+    4) if the service can't be reached, serve the stale snapshot, then the repo copy in fallback
+
+    :param asset: asset name, e.g. eras.json
+    :param fallback: optional path to a copy of the asset in the repo
+    :param ttl: seconds during which a cached asset is served without revalidation
+    :param cache_dir: directory holding the cache
+    :return: parsed object, or None
+    """
+    body_path, meta_path, snapshot_path = cache_paths(asset, cache_dir=cache_dir)
+    meta = load_meta(meta_path)
+    if meta and time.time() - meta.get("checked", 0) < ttl:
+        data = load_snapshot(snapshot_path)
+        if data is not None:
+            return data
+    headers = {}
+    if os.path.exists(snapshot_path):
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        r = requests.get(f"{staticdata_url}{asset}", headers=headers, timeout=60)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Could not fetch {asset} from the staticdata service: {e}")
+        r = None
+    os.makedirs(cache_dir, exist_ok=True)
+    if r is not None and r.status_code == requests.codes.not_modified:
+        data = load_snapshot(snapshot_path)
+        if data is not None:
+            meta["checked"] = time.time()
+            write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+            return data
+    elif r is not None and r.status_code == requests.codes.ok:
+        data = r.json()
+        write_atomic(body_path, r.content)
+        write_atomic(snapshot_path, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        meta = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "checked": time.time(),
+        }
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        return data
+    # The service is unavailable, or returned something unexpected, so use whatever we have locally.
+    data = load_snapshot(snapshot_path)
+    if data is not None:
+        logger.warning(f"Serving a stale copy of {asset}")
+        return data
+    return load_fallback(fallback)
@@ -1,6 +1,6 @@
 import glob
 import json
-import requests
+from static_cache import get_static
 
 
 def parse_taxonomy_files(source_dir):
@@ -9,10 +9,8 @@ def parse_taxonomy_files(source_dir):
     :param source_dir: Directory where the JSON files are stored
     :return:
     """
-    r = requests.get("https://alpha.nationalarchives.gov.uk/staticdata/taxonomy_keys.json")
-    if r.status_code == requests.codes.ok:
-        taxonomy_lookup = r.json()
-    else:
+    taxonomy_lookup = get_static("taxonomy_keys.json")
+    if not taxonomy_lookup:
         return
     master = {}
     files = glob.glob(f"{source_dir}/*")
@@ -54,9 +52,9 @@ def get_taxonomy(catalogue_reference):
 
 def make_taxonomy_lookup():
     taxo = {}
-    r = requests.get("https://alpha.nationalarchives.gov.uk/staticdata/taxonomy.json")
-    if r.status_code == requests.codes.ok:
-        j = r.json()
+    j = get_static("taxonomy.json")
+    if not j:
+        return
     for list_item in j:
         taxo[list_item["code"]] = list_item
     with open("taxonomy_keys.json", "w") as wf: